@@ -1,5 +1,13 @@
 # Developed for nand2tetris course, to translate hack assembly code into bytecode
+from array import array
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from glob import glob
+from itertools import count, islice, permutations
+from pathlib import Path, PurePath
+import argparse
 import sys
+import time
+import traceback
 
 symbols = {
     'SP': 0,
@@ -30,165 +38,354 @@ symbols = {
 num_predefined_symbols = len(symbols)
 
 jump_commands = {
-    '': '000',
-    'JGT': '001',
-    'JEQ': '010',
-    'JGE': '011',
-    'JLT': '100',
-    'JNE': '101',
-    'JLE': '110',
-    'JMP': '111'
+    '': 0b000,
+    'JGT': 0b001,
+    'JEQ': 0b010,
+    'JGE': 0b011,
+    'JLT': 0b100,
+    'JNE': 0b101,
+    'JLE': 0b110,
+    'JMP': 0b111
 }
 
 
 def make_destination_command(dest_code):
     ''' Take a destination code in the form ADM and return
-    a code in the form 101
+    a code in the form 0b101
     '''
-    return ''.join([str(int(code in dest_code)) for code in 'ADM'])
+    return ('A' in dest_code) << 2 | ('D' in dest_code) << 1 | ('M' in dest_code)
 
 
 calc_commands = {
-    '0': '0101010',
-    '1': '0111111',
-    '-1': '0111010',
-    'D': '0001100',
-    'A': '0110000',
-    'M': '1110000',
-    '!D': '0001101',
-    '!A': '0110001',
-    '!M': '1110001',
-    '-D': '0001111',
-    '-A': '0110011',
-    '-M': '1110011',
-    'D+1': '0011111',
-    'A+1': '0110111',
-    'M+1': '1110111',
-    'D-1': '0001110',
-    'A-1': '0110010',
-    'M-1': '1110010',
-    'D+A': '0000010',
-    'D+M': '1000010',
-    'D-A': '0010011',
-    'D-M': '1010011',
-    'A-D': '0000111',
-    'M-D': '1000111',
-    'D&A': '0000000',
-    'D&M': '1000000',
-    'D|A': '0010101',
-    'D|M': '1010101'
+    '0': 0b0101010,
+    '1': 0b0111111,
+    '-1': 0b0111010,
+    'D': 0b0001100,
+    'A': 0b0110000,
+    'M': 0b1110000,
+    '!D': 0b0001101,
+    '!A': 0b0110001,
+    '!M': 0b1110001,
+    '-D': 0b0001111,
+    '-A': 0b0110011,
+    '-M': 0b1110011,
+    'D+1': 0b0011111,
+    'A+1': 0b0110111,
+    'M+1': 0b1110111,
+    'D-1': 0b0001110,
+    'A-1': 0b0110010,
+    'M-1': 0b1110010,
+    'D+A': 0b0000010,
+    'D+M': 0b1000010,
+    'D-A': 0b0010011,
+    'D-M': 0b1010011,
+    'A-D': 0b0000111,
+    'M-D': 0b1000111,
+    'D&A': 0b0000000,
+    'D&M': 0b1000000,
+    'D|A': 0b0010101,
+    'D|M': 0b1010101,
+    # commutative forms, as written by VMTranslator (e.g. M=M+D)
+    'A+D': 0b0000010,
+    'M+D': 0b1000010,
+    'A&D': 0b0000000,
+    'M&D': 0b1000000,
+    'A|D': 0b0010101,
+    'M|D': 0b1010101
 }
 
 
-def read_file():
-    ''' Retrieve file specified on the command line and return as a list of
-    lines needed for assembly
+def make_c_instruction_codes():
+    ''' Precompute the machine code of every legal C-instruction, for each
+    ordering of its destination letters (MD and DM alike)
     '''
-    # read file from command line
-    file = sys.argv[1]
-    with open(file) as f:
-        asm = f.read()
-
-    # split file into individual lines. Get rid of whitespace, comment-only
-    # lines, and trailing comments
-    lines = asm.split('\n')
-    lines = [l.strip() for l in lines if l]
-    lines = [l.split(' ')[0] for l in lines if l[:2] != '//']
-
-    return lines, file
-
-
-def assign_variables(var_list, memory_used):
-    ''' After all variables are know, assign them memory locations starting
-        at 16.
+    destinations = [''] + [
+        ''.join(letters)
+        for length in range(1, 4)
+        for letters in permutations('ADM', length)
+    ]
+
+    codes = {}
+    for dest in destinations:
+        dest_prefix = dest + '=' if dest else ''
+        dest_code = make_destination_command(dest)
+        for calc, calc_code in calc_commands.items():
+            for jump, jump_code in jump_commands.items():
+                jump_suffix = ';' + jump if jump else ''
+                codes[dest_prefix + calc + jump_suffix] = \
+                    0b111 << 13 | calc_code << 6 | dest_code << 3 | jump_code
+    return codes
+
+
+c_instruction_codes = make_c_instruction_codes()
+
+
+def clean_lines(lines):
+    ''' Yield the part of each line needed for assembly. Get rid of
+    whitespace, blank and comment-only lines, and trailing comments
     '''
-    current_location = 16
-    for var in var_list:
-        if symbols.get(var):
-            continue
-
-        while current_location in memory_used:
-            current_location+=1
-
-        memory_used.add(current_location)
-        symbols[var] = current_location
-        current_location+=1
-
-    return None
-
-
-def collect_symbols(asm_list):
-    ''' In the first pass through the program, collect all symbols that need
-        numeric value assignment. Bookmark variables like @LOOP are assigned
-        values when there line is discovered. Memory variables like @i held
-        in a list for assignment in assign_variables.
-
-        This function was initially created to assign memory locations that
-        avoid collision with previously assigned memory, but that turned out
-        to be incompatible with the project specification. If collision
-        avoidance is unnecessary, as is the case, memory_used can be done away
-        with and memory variables can be assigned on discovery in the same
-        manner as bookmark variables
+    for l in lines:
+        l = l.strip()
+        if l and l[:2] != '//':
+            yield l.split(' ')[0]
+
+
+def _chunks(words, size):
+    ''' Split an iterable of words into arrays of at most size words '''
+    words = iter(words)
+    while True:
+        chunk = array('H', islice(words, size))
+        if not chunk:
+            return None
+        yield chunk
+
+
+def write_file(commands, filename, format='text', chunk_size=4096):
+    ''' Write machine code to the same path as the input path: as lines of
+    0s and 1s in a .hack file, or with format 'bin' as raw little-endian
+    16-bit words in a .bin file. commands may be any iterable of words; it
+    is written a chunk at a time. Return the number of words written
     '''
-    line_count = 0
-    memory_used = set(symbols.values())
-    var_list = []
-    for line in asm_list:
-        # each line is either a) an a-command b) a bookmark or c) a c-command
-
-        # if the line is an a-command or a c-command, increment the
-        # line counter
-
-        if line[0] == '@':
-            line_count+=1
-            # if numeric address, store value in memory_used
-            address = line[1:].split(' ')[0]
-
-            # lines used to avoid collision commented out
-            # if line[1].isdigit():
-            #   address = int(address)
-            #   memory_used.add(address)
-
-            # if variable, store in list and assign in assign_variables
-            if line[1].islower():
-                if address in set(var_list):
-                    continue
+    base_name = filename.split('.asm')[0]
+    num_words = 0
+    if format == 'bin':
+        with open(base_name + '.bin', 'wb') as f:
+            for chunk in _chunks(commands, chunk_size):
+                num_words += len(chunk)
+                if sys.byteorder == 'big':
+                    chunk.byteswap()
+                chunk.tofile(f)
+    else:
+        # separate all commands with newlines
+        with open(base_name + '.hack', 'w') as f:
+            separator = ''
+            for chunk in _chunks(commands, chunk_size):
+                num_words += len(chunk)
+                f.write(separator)
+                f.write('\n'.join(['{:016b}'.format(command) for command in chunk]))
+                separator = '\n'
+    return num_words
+
+
+class Listing:
+    ''' Listing files for one program, filled in while it is encoded. The
+    .lst file gives each instruction's ROM address, machine code, source line
+    number and text, with bookmarks listed at the address they stand for.
+    The .map file lists the address of every bookmark and variable
+    '''
+    def __init__(self, base_name):
+        self.lst = open(base_name + '.lst', 'w')
+        self.map_name = base_name + '.map'
+        self.address = 0
+        self.source = None
+        self.lst.write('  ROM  {:<16}   line  source\n'.format('word'))
+        return None
+
+    def listed_lines(self, lines):
+        ''' Clean lines as clean_lines does, remembering the number and
+        text of the line each instruction comes from
+        '''
+        for line_number, text in enumerate(lines, 1):
+            l = text.strip()
+            if l and l[:2] != '//':
+                l = l.split(' ')[0]
+                if l[0] == '(':
+                    self.lst.write('{:5}  {:16}  {:5}  {}\n'.format(
+                        self.address, '', line_number, text.strip()))
                 else:
-                    var_list.append(address)
-
-        # If bookmark line, do not increment line count, store line location
-        elif line[0] == '(':
-            bookmark = line[1:-1]
-            symbols[bookmark] = line_count
-
-        # if c-command, increment line count
+                    self.source = line_number, text.strip()
+                yield l
+        return None
+
+    def listed_words(self, words):
+        ''' Pass words through, listing each against the line it was
+        encoded from
+        '''
+        for word in words:
+            line_number, text = self.source
+            self.lst.write('{:5}  {:016b}  {:5}  {}\n'.format(
+                self.address, word, line_number, text))
+            self.address += 1
+            yield word
+        return None
+
+    def write_map(self, labels, variables):
+        ''' Write bookmarks and variables to the .map file, each group in
+        order of address
+        '''
+        with open(self.map_name, 'w') as f:
+            for title, group in (('labels', labels), ('variables', variables)):
+                f.write('// {}\n'.format(title))
+                for name, address in sorted(group.items(),
+                                            key=lambda item: item[1]):
+                    f.write('{:5}  {}\n'.format(address, name))
+        return None
+
+    def close(self):
+        self.lst.close()
+        return None
+
+
+class Assembler:
+    ''' Translates Hack assembly into machine code. Each Assembler keeps its
+    own symbol table, reset for every program, so one instance can assemble
+    many programs in a row and separate instances can run in parallel threads
+    '''
+    def __init__(self):
+        self.symbols = dict(symbols)
+        # bookmarks and variables of the last program, for listings
+        self.labels = {}
+        self.variables = {}
+        return None
+
+    def assemble(self, source):
+        ''' Assemble a program given as source text, an open file, a path to
+        a file, or an iterable of lines, and return its machine code as an
+        array of 16-bit words
+        '''
+        if isinstance(source, str):
+            lines = source.split('\n')
+        elif isinstance(source, PurePath):
+            with open(str(source)) as f:
+                lines = f.readlines()
+        elif hasattr(source, 'read'):
+            lines = source.read().split('\n')
         else:
-            line_count+=1
-
-    # get rid of pre-defined sybols or mis-cased symbols
-    var_list = [var for var in var_list if var not in symbols]
-    assign_variables(var_list, memory_used)
-
-    return None
+            lines = source
+
+        asm_list = list(clean_lines(lines))
+        self.collect_symbols(asm_list)
+        return array('H', self.encode_lines(asm_list))
+
+    def assemble_many(self, paths, threads=1):
+        ''' Assemble each file in paths and return their machine code, in
+        the order of paths. With threads > 1 the files are spread over a thread
+        pool, each thread using an Assembler of its own
+        '''
+        if threads > 1:
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                return list(executor.map(
+                    lambda path: Assembler().assemble(Path(path)), paths))
+        return [self.assemble(Path(path)) for path in paths]
+
+    def assemble_file(self, filename, format='text', listing=False):
+        ''' Assemble filename without holding the program in memory. The
+        first pass streams the file to collect symbols, the second streams it
+        again and writes each instruction's machine code as it is encoded.
+        With listing, .lst and .map files are written alongside in the same
+        second pass. Return the number of instructions written
+        '''
+        with open(filename) as f:
+            self.collect_symbols(clean_lines(f))
+
+        if not listing:
+            with open(filename) as f:
+                return write_file(self.encode_lines(clean_lines(f)), filename,
+                                  format)
+
+        listing = Listing(filename.split('.asm')[0])
+        try:
+            with open(filename) as f:
+                words = self.encode_lines(listing.listed_lines(f))
+                num_words = write_file(listing.listed_words(words), filename,
+                                       format)
+            listing.write_map(self.labels, self.variables)
+        finally:
+            listing.close()
+        return num_words
+
+    def assign_variables(self, var_list, memory_used):
+        ''' After all variables are know, assign them memory locations
+            starting at 16, in the order they were first seen and skipping
+            addresses already in memory_used.
+        '''
+        free_locations = (
+            location for location in count(16) if location not in memory_used
+        )
+        for var, location in zip(var_list, free_locations):
+            self.symbols[var] = self.variables[var] = location
+
+        return None
+
+    def collect_symbols(self, asm_list):
+        ''' In the first pass through the program, collect all symbols that
+            need numeric value assignment. Bookmark variables like @LOOP are
+            assigned values when there line is discovered. Memory variables
+            like @i are kept, in order of first sight, for assignment in
+            assign_variables once every bookmark is known, since a bookmark
+            may be referenced before its line.
+
+            var_list is a dict used as an ordered set, so each reference
+            to a variable costs one lookup however many variables there are
+        '''
+        # start every program from the predefined symbols only
+        self.symbols = dict(symbols)
+        self.labels = {}
+        self.variables = {}
+
+        line_count = 0
+        memory_used = set(self.symbols.values())
+        var_list = {}
+        for line in asm_list:
+            # each line is either a) an a-command b) a bookmark or
+            # c) a c-command
+
+            # if the line is an a-command or a c-command, increment the
+            # line counter
+
+            if line[0] == '@':
+                line_count+=1
+
+                # if symbolic, store in var_list and assign in
+                # assign_variables unless it turns out to be a bookmark
+                if not line[1].isdigit():
+                    var_list[line[1:]] = None
+
+            # If bookmark line, do not increment line count, store line
+            # location
+            elif line[0] == '(':
+                bookmark = line[1:-1]
+                self.symbols[bookmark] = self.labels[bookmark] = line_count
+
+            # if c-command, increment line count
+            else:
+                line_count+=1
+
+        # get rid of pre-defined symbols and bookmarks
+        var_list = [var for var in var_list if var not in self.symbols]
+        self.assign_variables(var_list, memory_used)
+
+        return None
+
+    def encode_lines(self, asm_lines):
+        ''' Yield the machine code of each instruction in asm_lines, which
+        may be any iterable of cleaned lines. Every distinct line is encoded
+        once: C-instructions come precomputed from c_instruction_codes, and
+        other lines are cached the first time they are seen
+        '''
+        line_codes = dict(c_instruction_codes)
+        for line in asm_lines:
+            code = line_codes.get(line)
+            if code is None:
+                # skip comments and bookmarks
+                if line[:2] == '//' or line[0] == '(':
+                    continue
+                code = line_codes[line] = self.encode_line(line)
+            yield code
 
+        return None
 
-def assemble(asm_list):
-    command_list = []
-    # for each line of assembly, translate to machine code
-    for line in asm_list:
-        # skip comments and bookmarks
-        if line[:2] == '//' or line[0] == '(':
-            continue
+    def encode_line(self, line):
+        ''' Translate one line of assembly to machine code '''
         # a-command
         if line[0] == '@':
             # if numeric adress
             address = line[1:].split(' ')[0]
             if line[1].isdigit():
-                address = int(address)
-                command_list.append(f'{address:b}'.zfill(16))
+                return int(address)
             # if variable
             else:
-                command_list.append('{:b}'.format(symbols[address]).zfill(16))
+                return self.symbols[address]
         # c-command
         else:
             # make jump code
@@ -206,23 +403,107 @@ def assemble(asm_list):
             # make calculation code
             calc_code = calc_commands[line]
 
-            command = '111' + calc_code + dest_code + jump_code
-            command_list.append(command)
+            return 0b111 << 13 | calc_code << 6 | dest_code << 3 | jump_code
+
+
+def find_sources(inputs):
+    ''' Expand the command line inputs into a sorted list of .asm files.
+    Each input may be a file, a directory of .asm files or a glob pattern
+    '''
+    files = set()
+    for pattern in inputs:
+        for path in glob(pattern) or [pattern]:
+            path = Path(path)
+            if path.is_dir():
+                files.update(path.glob('*.asm'))
+            else:
+                files.add(path)
+    return sorted(files)
+
+
+def assemble_path(path, format='text', listing=False):
+    ''' Assemble one .asm file with its own Assembler, so no symbols carry
+    over from other files, and return (path, ROM words written, seconds,
+    error). A file that fails to assemble gives 0 words and its traceback
+    as error, which is None otherwise. Every field pickles, for --jobs
+    '''
+    start = time.perf_counter()
+    num_instructions, error = 0, None
+    try:
+        num_instructions = Assembler().assemble_file(str(path), format,
+                                                     listing)
+    except Exception:
+        error = traceback.format_exc()
+
+    return path, num_instructions, time.perf_counter() - start, error
+
+
+def assemble_paths(paths, jobs=1, format='text', listing=False):
+    ''' Yield the assemble_path result for each .asm file in paths. With
+    jobs above 1 the files are spread over that many processes, but results
+    are still yielded in input order, so the report reads the same for any
+    number of jobs
+    '''
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [
+                executor.submit(assemble_path, path, format, listing)
+                for path in paths
+            ]
+            for future in futures:
+                yield future.result()
+    else:
+        for path in paths:
+            yield assemble_path(path, format, listing)
+    return None
 
-    return command_list
 
+def report_throughput(results, wall_seconds):
+    ''' Print the total ROM words written by results and the rate over the
+    wall clock time of the whole run. Failed files count 0 words
+    '''
+    num_instructions = sum(result[1] for result in results)
+    print('{} files, {} instructions in {:.3f} s: {:.0f} instructions/s'
+          .format(len(results), num_instructions, wall_seconds,
+                  num_instructions / wall_seconds if wall_seconds else 0))
+    return None
 
-def write_file(commands, filename):
-    # combine all commands with newline seperator
-    big_word = '\n'.join(all_commands)
 
-    # write file to same path as input path
-    with open(filename.split('.asm')[0] + '.hack', 'w') as f:
-        f.write(big_word)
+def parse_args():
+    arg_parser = argparse.ArgumentParser(
+        description='Assemble Hack .asm files into machine code')
+    arg_parser.add_argument('input', nargs='+',
+                            help='.asm files, directories of them or glob '
+                                 'patterns')
+    arg_parser.add_argument('--format', choices=['text', 'bin'],
+                            default='text',
+                            help='text .hack file (default) or raw '
+                                 'little-endian words in a .bin file')
+    arg_parser.add_argument('--jobs', '-j', type=int, default=1,
+                            help='number of files to assemble in parallel')
+    arg_parser.add_argument('--listing', action='store_true',
+                            help='also write a .lst listing and a .map '
+                                 'symbol file next to each source')
+    return arg_parser.parse_args()
 
 
 if __name__ == '__main__':
-    asm_list, filename = read_file()
-    collect_symbols(asm_list)
-    all_commands = assemble(asm_list)
-    write_file(all_commands, filename)
+    args = parse_args()
+
+    files = find_sources(args.input)
+    start = time.perf_counter()
+
+    results = []
+    for result in assemble_paths(files, jobs=args.jobs, format=args.format,
+                                 listing=args.listing):
+        path, num_instructions, seconds, error = result
+        if error:
+            print('{} FAILED'.format(path))
+            print(error, file=sys.stderr)
+        else:
+            print('{} {} instructions'.format(path, num_instructions))
+        results.append(result)
+
+    report_throughput(results, time.perf_counter() - start)
+    if any(error for _, _, _, error in results):
+        sys.exit(1)
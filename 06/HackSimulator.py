@@ -0,0 +1,284 @@
+# Developed for nand2tetris course, to run Hack machine code produced by
+# HackAssembler.py without the CPU emulator
+from HackAssembler import calc_commands
+
+from array import array
+import argparse
+import sys
+
+# optional, for zero-copy RAM and screen views
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+ram_size = 32768
+screen_address = 16384
+screen_rows, screen_columns = 256, 512
+screen_words = screen_rows * screen_columns // 16
+keyboard_address = 24576
+
+# condition on the computed value v for each jump code
+jump_conditions = {
+    0b001: 'v > 0',
+    0b010: 'v == 0',
+    0b011: 'v >= 0',
+    0b100: 'v < 0',
+    0b101: 'v != 0',
+    0b110: 'v <= 0',
+    0b111: 'True',
+}
+
+
+def make_calc_expressions():
+    ''' Python expression for each calculation code, in terms of registers
+    a and d and m, the RAM word at a. Registers hold signed 16-bit values,
+    so only sums and differences need wrapping back into range
+    '''
+    expressions = {}
+    for calc, calc_code in calc_commands.items():
+        if calc_code in expressions:
+            continue
+        expression = calc.translate(str.maketrans('ADM!', 'adm~'))
+        expression = expression.replace('m', 'ram[a]')
+        if calc != '-1' and ('+' in calc or '-' in calc):
+            expression = '({} + 32768 & 65535) - 32768'.format(expression)
+        expressions[calc_code] = expression
+    return expressions
+
+
+calc_expressions = make_calc_expressions()
+
+
+class Halt(Exception):
+    ''' Raised by the jump of a (LOOP) @LOOP 0;JMP loop, the usual way a Hack
+    program ends
+    '''
+    pass
+
+
+def load_rom(filename):
+    ''' Read machine code from a .hack text file, or raw little-endian words
+    from a .bin file, and return it as an array of words
+    '''
+    rom = array('H')
+    if filename.endswith('.bin'):
+        with open(filename, 'rb') as f:
+            rom.frombytes(f.read())
+        if sys.byteorder == 'big':
+            rom.byteswap()
+    else:
+        with open(filename) as f:
+            rom.extend(int(line, 2) for line in f if line.strip())
+    return rom
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError('RAM and screen views require numpy')
+    return None
+
+
+def unpack_screen(words):
+    ''' Unpack screen words, as from HackSimulator.screen_view, into a
+    256x512 array of pixels, 1 for black. Bit 0 of each word is its leftmost
+    pixel
+    '''
+    _require_numpy()
+    words = np.ascontiguousarray(words, dtype='<u2')
+    pixels = np.unpackbits(words.view(np.uint8), bitorder='little')
+    return pixels.reshape(screen_rows, screen_columns)
+
+
+def diff_frames(before, after):
+    ''' Return the (row, column) of every pixel that differs between two
+    frames of screen words. Words are compared first, so only the words that
+    changed are unpacked
+    '''
+    _require_numpy()
+    changed = np.flatnonzero(np.asarray(before).ravel()
+                             != np.asarray(after).ravel())
+    if not changed.size:
+        return np.empty((0, 2), dtype=np.intp)
+
+    flipped = (np.asarray(before).ravel()[changed]
+               ^ np.asarray(after).ravel()[changed])
+    bits = np.unpackbits(
+        np.ascontiguousarray(flipped, dtype='<u2').view(np.uint8),
+        bitorder='little').reshape(-1, 16)
+    word_index, bit = np.nonzero(bits)
+    pixel = changed[word_index] * 16 + bit
+    return np.stack(np.divmod(pixel, screen_columns), axis=1)
+
+
+class HackSimulator:
+    ''' Hack CPU with a flat RAM of signed 16-bit words. Every distinct ROM
+    word is decoded once into a Python function taking and returning the
+    registers (a, d, pc); running the program is then one call per
+    instruction through the table of those functions, indexed by pc
+    '''
+    def __init__(self, rom):
+        self.rom = array('H', rom)
+        self.ram = array('h', bytes(2 * ram_size))
+        self.a = self.d = self.pc = 0
+        self.cycles = 0
+        self.ops = self._decode(self.rom)
+        return None
+
+    def _decode(self, rom):
+        codes = {}
+        ops = []
+        for address, word in enumerate(rom):
+            if self._is_halt(rom, address):
+                ops.append(self._halt)
+                continue
+            op = codes.get(word)
+            if op is None:
+                op = codes[word] = self._decode_word(word)
+            ops.append(op)
+        # running off the end of the program stops it
+        ops.append(self._halt)
+        return ops
+
+    def _is_halt(self, rom, address):
+        ''' True for the jump of a loop made of @address-1 and 0;JMP '''
+        return (address > 0 and rom[address - 1] == address - 1
+                and rom[address] & 0b1110000000000111 == 0b1110000000000111)
+
+    def _halt(self, a, d, pc):
+        raise Halt()
+
+    def _decode_word(self, word):
+        ''' Build the function that executes one instruction '''
+        if not word & 0x8000:
+            # a-instruction: the value always fits in 15 bits
+            def load_a(a, d, pc, value=word):
+                return value, d, pc + 1
+            return load_a
+
+        calc = calc_expressions[word >> 6 & 0b1111111]
+        dest = word >> 3 & 0b111
+        jump = word & 0b111
+
+        lines = ['def op(a, d, pc):', '    v = ' + calc]
+        # M is written at the old a, and the jump goes to the old a
+        if dest & 0b001:
+            lines.append('    ram[a] = v')
+        next_pc = 'pc + 1'
+        if jump:
+            next_pc = 'a if {} else pc + 1'.format(jump_conditions[jump])
+        lines.append('    return {}, {}, {}'.format(
+            'v' if dest & 0b100 else 'a',
+            'v' if dest & 0b010 else 'd',
+            next_pc))
+
+        namespace = {'ram': self.ram}
+        exec('\n'.join(lines), namespace)
+        return namespace['op']
+
+    def run(self, limit=None):
+        ''' Execute at most limit instructions, or until the program halts,
+        and return the number executed
+        '''
+        ops = self.ops
+        a, d, pc = self.a, self.d, self.pc
+        executed = 0
+        try:
+            if limit is None:
+                while True:
+                    a, d, pc = ops[pc](a, d, pc)
+                    executed += 1
+            else:
+                for executed in range(limit):
+                    a, d, pc = ops[pc](a, d, pc)
+                executed = limit
+        except Halt:
+            pass
+        finally:
+            self.a, self.d, self.pc = a, d, pc
+            self.cycles += executed
+        return executed
+
+    def ram_view(self):
+        ''' NumPy view of RAM sharing memory with the simulator: reads see
+        the running program's writes, and writes go straight to its RAM
+        '''
+        _require_numpy()
+        return np.frombuffer(self.ram, dtype=np.int16)
+
+    def screen_view(self):
+        ''' NumPy view of the screen memory map as 256 rows of 32 words.
+        Take .copy() of it to keep a frame
+        '''
+        screen = self.ram_view()[screen_address:screen_address + screen_words]
+        return screen.reshape(screen_rows, screen_columns // 16)
+
+    def screen_pixels(self):
+        ''' The screen as a 256x512 array of pixels, 1 for black '''
+        return unpack_screen(self.screen_view())
+
+    def set_key(self, key):
+        ''' Hold down the key with the given Hack character code, 0 for none '''
+        self.ram[keyboard_address] = key
+        return None
+
+    def screen_rows(self):
+        ''' Yield each row of the screen as a string of # and . '''
+        ram = self.ram
+        for row in range(screen_rows):
+            start = screen_address + row * screen_columns // 16
+            yield ''.join(
+                '#' if ram[start + column // 16] >> (column % 16) & 1 else '.'
+                for column in range(screen_columns)
+            )
+        return None
+
+    def dump_screen(self, filename):
+        ''' Write the screen to a binary PBM image. A Hack screen word holds
+        its leftmost pixel in bit 0 and PBM the other way round, so each byte
+        is bit-reversed
+        '''
+        reverse = bytes(int('{:08b}'.format(i)[::-1], 2) for i in range(256))
+        screen = self.ram[screen_address:screen_address + screen_words]
+        pixels = bytearray()
+        for word in screen:
+            pixels.append(reverse[word & 0xff])
+            pixels.append(reverse[word >> 8 & 0xff])
+        with open(filename, 'wb') as f:
+            f.write('P4\n{} {}\n'.format(screen_columns, screen_rows).encode())
+            f.write(pixels)
+        return None
+
+
+def parse_range(text):
+    start, _, end = text.partition(':')
+    return int(start), int(end or start) + (0 if end else 1)
+
+
+def parse_args():
+    arg_parser = argparse.ArgumentParser(
+        description='Run Hack machine code from a .hack or .bin file')
+    arg_parser.add_argument('input', help='.hack or .bin file to run')
+    arg_parser.add_argument('--limit', type=int, default=None,
+                            help='stop after this many instructions')
+    arg_parser.add_argument('--ram', default='0:16',
+                            help='RAM addresses to print, as start:end')
+    arg_parser.add_argument('--screen',
+                            help='write the screen to this .pbm file')
+    return arg_parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    simulator = HackSimulator(load_rom(args.input))
+    executed = simulator.run(args.limit)
+    print('{} instructions, pc={} a={} d={}'.format(
+        executed, simulator.pc, simulator.a, simulator.d))
+
+    start, end = parse_range(args.ram)
+    for address in range(start, end):
+        print('RAM[{}] = {}'.format(address, simulator.ram[address]))
+
+    if args.screen:
+        simulator.dump_screen(args.screen)
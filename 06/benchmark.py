@@ -0,0 +1,98 @@
+# Throughput benchmarks for the Hack assembler. Run from this directory:
+#   python benchmark.py [num_symbols]
+import sys
+import time
+
+from HackAssembler import Assembler
+from HackSimulator import HackSimulator
+
+
+def make_symbol_program(num_symbols, references=4):
+    ''' Return the lines of a synthetic program with num_symbols distinct
+    variables, each referenced the given number of times inside one loop.
+    The program is larger than ROM, which the assembler does not check
+    '''
+    lines = ['(loop)']
+    for n in range(num_symbols):
+        for _ in range(references):
+            lines.append('@var{}'.format(n))
+            lines.append('M=M+1')
+    lines.append('@loop')
+    lines.append('0;JMP')
+    return lines
+
+
+def time_call(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def bench_symbols(sizes=(5000, 10000, 20000, 40000)):
+    ''' Assemble programs with increasingly many variables. With constant
+    time variable lookup the time per symbol stays flat as the count grows
+    '''
+    print('symbols:')
+    assembler = Assembler()
+    for num_symbols in sizes:
+        lines = make_symbol_program(num_symbols)
+        seconds, words = time_call(assembler.assemble, lines)
+        print('  {:>6} symbols {:8.3f} s {:8.2f} us/symbol {:>8} words'.format(
+            num_symbols, seconds, seconds / num_symbols * 1e6, len(words)))
+    return None
+
+
+# sums 1..n into sum, repeats times over, touching RAM on every step,
+# then halts
+counting_program = '''
+@{repeats}
+D=A
+@j
+M=D
+(outer)
+@{n}
+D=A
+@i
+M=D
+@sum
+M=0
+(loop)
+@i
+D=M
+@next
+D;JEQ
+@sum
+M=M+D
+@i
+M=M-1
+@loop
+0;JMP
+(next)
+@j
+MD=M-1
+@outer
+D;JGT
+(end)
+@end
+0;JMP
+'''
+
+
+def bench_simulator(n=10000, repeats=50):
+    ''' Run a counting loop on the simulator and report instructions per
+    second
+    '''
+    words = Assembler().assemble(counting_program.format(n=n, repeats=repeats))
+    simulator = HackSimulator(words)
+    seconds, executed = time_call(simulator.run)
+    print('simulator: {} instructions {:8.3f} s {:10.0f} instructions/s'
+          .format(executed, seconds, executed / seconds))
+    return None
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        bench_symbols((int(sys.argv[1]),))
+    else:
+        bench_symbols()
+    bench_simulator()
@@ -0,0 +1,159 @@
+# Developed for nand2tetris course, to shrink the Hack assembly written by
+# VMTranslator.py before it goes to the assembler
+binary_operators = ['+', '-', '&', '|']
+unary_operators = ['-', '!']
+
+# the tail of every push, once the value to push is in D
+push_tail = ['@SP', 'A=M', 'M=D', '@SP', 'M=M+1']
+
+
+def make_patterns(keep_d=False):
+    ''' Rewrites as (instructions, replacement) pairs, most specific first.
+    Most of them leave a different value in D, which relies on D being dead
+    between VM commands. That holds for code CodeWriter writes without
+    cache_top, but with it D may hold the top of the stack, so keep_d gives
+    only the rewrites that leave D as it was
+    '''
+    if keep_d:
+        return _d_keeping_patterns()
+
+    patterns = []
+    for op in binary_operators:
+        # push x; op: the pushed value is still in D, so apply it to the
+        # top of the stack in place
+        patterns.append((
+            push_tail + [
+                '@SP', 'A=M-1', 'D=M', 'A=A-1', 'M=M{}D'.format(op),
+                'D=A+1', '@SP', 'M=D'
+            ],
+            ['@SP', 'A=M-1', 'M=M{}D'.format(op)]
+        ))
+    for op in ['+', '-']:
+        # push constant 1; add or sub
+        patterns.append((
+            ['@1', 'D=A', '@SP', 'A=M-1', 'M=M{}D'.format(op)],
+            ['@SP', 'A=M-1', 'M=M{}1'.format(op)]
+        ))
+    for op in binary_operators:
+        # binary op: decrement SP with the load of y instead of recomputing
+        # it from A afterwards
+        patterns.append((
+            ['@SP', 'A=M-1', 'D=M', 'A=A-1', 'M=M{}D'.format(op),
+             'D=A+1', '@SP', 'M=D'],
+            ['@SP', 'AM=M-1', 'D=M', 'A=A-1', 'M=M{}D'.format(op)]
+        ))
+    for op in unary_operators:
+        # unary op: SP does not change
+        patterns.append((
+            ['@SP', 'A=M-1', 'M={}M'.format(op), 'D=A+1', '@SP', 'M=D'],
+            ['@SP', 'A=M-1', 'M={}M'.format(op)]
+        ))
+    return patterns + _d_keeping_patterns()
+
+
+def _d_keeping_patterns():
+    ''' Rewrites that leave D as it was '''
+    return [
+        # push x; pop: the popped value is already in D
+        (push_tail + ['@SP', 'M=M-1', 'A=M', 'D=M'], []),
+        # any other SP round trip
+        (['@SP', 'M=M+1', '@SP', 'M=M-1'], ['@SP']),
+    ]
+
+
+patterns = make_patterns()
+d_keeping_patterns = make_patterns(keep_d=True)
+
+
+def is_comment(line):
+    return line[:2] == '//' or not line
+
+
+def is_instruction(line):
+    return not is_comment(line) and line[0] != '('
+
+
+def split_lines(lines):
+    ''' CodeWriter output holds several instructions per string, one per
+    line; give each its own entry
+    '''
+    return [line.strip() for text in lines for line in text.split('\n')]
+
+
+def _match(lines, start, pattern):
+    ''' Return the index after the lines at start that match pattern,
+    skipping comments, or None if they do not match
+    '''
+    i = start
+    for expected in pattern:
+        while i < len(lines) and is_comment(lines[i]):
+            i += 1
+        if i == len(lines) or lines[i] != expected:
+            return None
+        i += 1
+    return i
+
+
+def rewrite(lines, patterns=patterns):
+    ''' One pass of pattern rewrites. Comments inside a rewritten window are
+    kept, ahead of its replacement
+    '''
+    new_lines = []
+    i = 0
+    while i < len(lines):
+        if is_comment(lines[i]):
+            new_lines.append(lines[i])
+            i += 1
+            continue
+
+        for pattern, replacement in patterns:
+            end = _match(lines, i, pattern)
+            if end is not None:
+                new_lines.extend(l for l in lines[i:end] if is_comment(l))
+                new_lines.extend(replacement)
+                i = end
+                break
+        else:
+            new_lines.append(lines[i])
+            i += 1
+    return new_lines
+
+
+def drop_reloads(lines):
+    ''' Drop @X where A already holds X. A is unknown after a label, and
+    after any instruction that writes to it
+    '''
+    new_lines = []
+    known_a = None
+    for line in lines:
+        if is_comment(line):
+            pass
+        elif line[0] == '(':
+            known_a = None
+        elif line[0] == '@':
+            if line == known_a:
+                continue
+            known_a = line
+        elif 'A' in line.split('=')[0] and '=' in line:
+            known_a = None
+        new_lines.append(line)
+    return new_lines
+
+
+def optimize(lines, cache_top=False):
+    ''' Return the assembly in lines, with one instruction per line, after
+    rewriting until no pattern applies. Code written with cache_top only
+    gets the rewrites that keep D
+    '''
+    rules = d_keeping_patterns if cache_top else patterns
+    lines = split_lines(lines)
+    while True:
+        new_lines = drop_reloads(rewrite(lines, rules))
+        if new_lines == lines:
+            return lines
+        lines = new_lines
+
+
+def count_instructions(lines):
+    ''' number of ROM words the assembly in lines takes '''
+    return sum(1 for line in split_lines(lines) if is_instruction(line))
@@ -0,0 +1,97 @@
+# Developed for nand2tetris course, to simplify parsed VM commands before
+# VMTranslator.py's CodeWriter turns them into assembly
+#
+# Commands are (command_type, arg1, arg2) tuples, with the fields of
+# Parser.Line. Besides the VM commands, the pass writes pseudo-commands that
+# CodeWriter knows how to translate:
+#   ('arithmetic', 'eqz', None)     replace the top of stack x by x == 0
+#   ('if_zero', label, None)        pop x, jump to label if x == 0
+#   ('move', (seg, i), (seg, i))    push from the first, pop into the second
+folds = {
+    'add': lambda x, y: x + y,
+    'sub': lambda x, y: x - y,
+    'and': lambda x, y: x & y,
+    'or': lambda x, y: x | y,
+}
+
+# the largest value push constant can load
+max_constant = 32767
+
+
+def _constant(command):
+    ''' value pushed by command if it is a push constant, otherwise None '''
+    if command[0] == 'push' and command[1] == 'constant':
+        return int(command[2])
+    return None
+
+
+def _simplify_tail(commands):
+    ''' Rewrite the last commands in place, once. Return True if anything
+    changed
+    '''
+    last = commands[-1]
+
+    # push constant a; push constant b; op: fold when the result is still
+    # a valid constant
+    if last[0] == 'arithmetic' and last[1] in folds and len(commands) >= 3:
+        x, y = _constant(commands[-3]), _constant(commands[-2])
+        if x is not None and y is not None:
+            value = folds[last[1]](x, y)
+            if 0 <= value <= max_constant:
+                commands[-3:] = [('push', 'constant', str(value))]
+                return True
+
+    if len(commands) < 2:
+        return False
+    previous = commands[-2]
+
+    # push constant 0; eq: compare against zero without the push
+    if last == ('arithmetic', 'eq', None) and _constant(previous) == 0:
+        commands[-2:] = [('arithmetic', 'eqz', None)]
+        return True
+
+    if last[0] == 'if':
+        # eqz; if-goto: jump on zero directly
+        if previous == ('arithmetic', 'eqz', None):
+            commands[-2:] = [('if_zero', last[1], None)]
+            return True
+        # eqz; not; if-goto: if-goto already jumps on anything but zero
+        if (len(commands) >= 3 and previous == ('arithmetic', 'not', None)
+                and commands[-3] == ('arithmetic', 'eqz', None)):
+            commands[-3:] = [last]
+            return True
+
+    # push; pop: move the value without the stack, or nothing at all if it
+    # goes back where it came from
+    if last[0] == 'pop' and previous[0] == 'push':
+        source, destination = previous[1:], last[1:]
+        if source == destination:
+            del commands[-2:]
+        else:
+            commands[-2:] = [('move', source, destination)]
+        return True
+
+    return False
+
+
+def optimize_commands(commands):
+    ''' Return the commands with constants folded, comparisons against zero
+    turned into tests, pushes that are popped straight away turned into
+    moves, and code that can never run after goto or return dropped up to
+    the next label or function
+    '''
+    optimized = []
+    unreachable = False
+    for command in commands:
+        if unreachable:
+            if command[0] not in ['label', 'function']:
+                continue
+            unreachable = False
+
+        optimized.append(command)
+        while optimized and _simplify_tail(optimized):
+            pass
+
+        if command[0] in ['goto', 'return']:
+            unreachable = True
+    return optimized
@@ -1,4 +1,8 @@
 # Developed for nand2tetris course, to translate VM code into Hack Assembly code
+from Peephole import count_instructions, optimize
+from VMOptimizer import optimize_commands
+
+import argparse
 import os
 import sys
 from pathlib import Path
@@ -74,12 +78,25 @@ class Parser:
 
 
 class CodeWriter:
-    def __init__(self):
+    def __init__(self, shared_calls=False, shared_comparisons=False,
+                 cache_top=False):
         self.num_bookmarks = 0
         self.num_calls = 0
         self.num_returns = 0
         self.bootstrapped = False
         self.static_name = 'f'
+        # with shared_calls, call and return jump to one shared copy of
+        # their code instead of inlining it, and with shared_comparisons
+        # so do eq, gt and lt
+        self.shared_calls = shared_calls
+        self.shared_comparisons = shared_comparisons
+        self.shared_routines = set()
+        # with cache_top, the value on top of the stack may be held in D
+        # instead of RAM; top_in_d says whether it is right now. It is
+        # written out before labels, jumps, calls, returns and comparisons,
+        # so code that jumps anywhere finds the whole stack in RAM
+        self.cache_top = cache_top
+        self.top_in_d = False
 
     def write_code(self, line):
         self.lines = []
@@ -102,6 +119,39 @@ class CodeWriter:
 
         return '\n'.join(self.lines)
 
+    def finish(self):
+        ''' Return the code that ends a translation: a top of stack still
+        cached in D is written to RAM
+        '''
+        self.lines = []
+        self._flush()
+        return '\n'.join(self.lines)
+
+    def _flush(self):
+        ''' Write the top of stack cached in D, if any, to RAM '''
+        if self.top_in_d:
+            self.lines.extend([
+                '@SP',
+                'AM=M+1',
+                'A=A-1',
+                'M=D'
+            ])
+            self.top_in_d = False
+        return None
+
+    def _load_top(self):
+        ''' Make sure the top of stack is cached in D, popping it from RAM
+        if it is not
+        '''
+        if not self.top_in_d:
+            self.lines.extend([
+                '@SP',
+                'AM=M-1',
+                'D=M'
+            ])
+            self.top_in_d = True
+        return None
+
     def _write_custom_line(self, command_type, arg1, arg2):
         '''create new line from passed arguments'''
         line = Parser.Line()
@@ -142,6 +192,16 @@ class CodeWriter:
     def _arithmetic(self, line):
         operation = line.arg1
 
+        if self.cache_top:
+            if operation not in ['eq', 'lt', 'gt', 'eqz']:
+                self._cached_arithmetic(operation)
+                return None
+            self._flush()
+
+        if self.shared_comparisons and operation in ['eq', 'lt', 'gt']:
+            self._shared_comparison(operation)
+            return None
+
         # move pointer to end of stack
         self.lines.extend([
             '@SP',
@@ -154,9 +214,34 @@ class CodeWriter:
             self._make_comparison_command(operation)
         elif operation in ['neg', 'not']:
             self._make_invert_command(operation)
+        elif operation == 'eqz':
+            self._make_zero_test()
 
         return None
 
+    def _cached_arithmetic(self, operation):
+        ''' Compute with y in D and leave the result there, popping x from
+        RAM for binary operations
+        '''
+        func_map = {
+            'add': '+',
+            'sub': '-',
+            'and': '&',
+            'or': '|',
+            'neg': '-',
+            'not': '!'
+        }
+        self._load_top()
+        if operation in ['neg', 'not']:
+            self.lines.append('D={}D'.format(func_map[operation]))
+        else:
+            self.lines.extend([
+                '@SP',
+                'AM=M-1',
+                'D=M{}D'.format(func_map[operation])
+            ])
+        return None
+
     def _make_invert_command(self, operation):
         func_map = {
             'neg': '-',
@@ -185,6 +270,23 @@ class CodeWriter:
             'M=D'
         ])
 
+    def _make_zero_test(self):
+        ''' x == 0, for the eqz command VMOptimizer writes in place of
+        push constant 0 / eq
+        '''
+        self.num_bookmarks += 1
+        self.lines.extend([
+            'D=M',
+            'M=-1',
+            '@ZERO{}'.format(self.num_bookmarks),
+            'D;JEQ',
+            '@SP',
+            'A=M-1',
+            'M=0',
+            '(ZERO{})'.format(self.num_bookmarks)
+        ])
+        return None
+
     def _make_comparison_command(self, operation):
         # increment num_bookmarks to avoid bookmark collision
         self.num_bookmarks += 1
@@ -238,8 +340,55 @@ class CodeWriter:
         ])
         return None
 
+    def _shared_comparison(self, operation):
+        ''' Compare through the shared $$EQ, $$GT or $$LT routine, passing
+        the return address in D
+        '''
+        self.num_bookmarks += 1
+        name = '$$' + operation.upper()
+        self._write_shared_routine(
+            name, lambda: self._write_comparison_body(name, operation))
+        self.lines.extend([
+            '@COMPRET{}'.format(self.num_bookmarks),
+            'D=A',
+            '@{}'.format(name),
+            '0;JMP',
+            '(COMPRET{})'.format(self.num_bookmarks)
+        ])
+        return None
+
+    def _write_comparison_body(self, name, operation):
+        func_map = {
+            'eq': 'JEQ',
+            'gt': 'JGT',
+            'lt': 'JLT'
+        }
+        # keep the return address in R15, pop y and set x to true, then to
+        # false unless x - y passes the comparison
+        self.lines.extend([
+            '@R15',
+            'M=D',
+            '@SP',
+            'AM=M-1',
+            'D=M',
+            'A=A-1',
+            'D=M-D',
+            'M=-1',
+            '@{}_TRUE'.format(name),
+            'D;{}'.format(func_map[operation]),
+            '@SP',
+            'A=M-1',
+            'M=0',
+            '({}_TRUE)'.format(name),
+            '@R15',
+            'A=M',
+            '0;JMP'
+        ])
+        return None
+
     def _push(self, line):
         source, val = line.arg1, line.arg2
+        self._flush()
 
         # use lower functions to retrieve value and store it in D
         if source == 'constant':
@@ -249,6 +398,11 @@ class CodeWriter:
         else:
             self._push_pointer(source, val)
 
+        # with cache_top the value stays in D until it is needed
+        if self.cache_top:
+            self.top_in_d = True
+            return None
+
         # after the value is retrieved from the source and stored in D,
         # put on top of stack and increment pointer
         self.lines.extend([
@@ -305,6 +459,17 @@ class CodeWriter:
         return None
 
     def _pop(self, line):
+        if self.cache_top:
+            self._cached_pop(line)
+            return None
+
+        # far into a segment, work out the destination address before the
+        # value is popped into D
+        if (line and line.arg1 in ['local', 'argument', 'this', 'that']
+                and int(line.arg2) > 7):
+            self._pop_indexed(line.arg1, line.arg2)
+            return None
+
         # retrieve value from top of stack
         self.lines.extend([
                 '@SP',
@@ -323,6 +488,67 @@ class CodeWriter:
                 self._pop_method_level(destination, val)
         return None
 
+    def _cached_pop(self, line):
+        ''' Pop with cache_top: the value ends up in D either way, then is
+        stored like any other pop
+        '''
+        self._load_top()
+        self.top_in_d = False
+        if not line:
+            return None
+
+        self._store(line.arg1, line.arg2)
+        return None
+
+    def _store(self, destination, val):
+        ''' Store D in a segment without going through the stack '''
+        if destination in ['pointer', 'temp', 'static']:
+            self._pop_pointer(destination, val)
+        elif int(val) <= 11:
+            # with the value already in D, stepping to the address takes
+            # val + 2 instructions, against 13 for going through R13 and R14
+            self._pop_method_level(destination, val)
+        else:
+            # D is taken, so park the value in R13 while the address is
+            # worked out into R14
+            pop_dict = {
+                'local': 'LCL',
+                'argument': 'ARG',
+                'this': 'THIS',
+                'that': 'THAT'
+            }
+            self.lines.extend([
+                '@R13',
+                'M=D',
+                '@{}'.format(pop_dict[destination]),
+                'D=M',
+                '@{}'.format(val),
+                'D=D+A',
+                '@R14',
+                'M=D',
+                '@R13',
+                'D=M',
+                '@R14',
+                'A=M',
+                'M=D'
+            ])
+        return None
+
+    def _move(self, line):
+        ''' push arg1 then pop into arg2, for the move command VMOptimizer
+        writes: the value goes through D only
+        '''
+        (source, source_val), (destination, val) = line.arg1, line.arg2
+        self._flush()
+        if source == 'constant':
+            self._push_constant(source_val)
+        elif source in ['local', 'argument', 'this', 'that']:
+            self._push_method_level(source, source_val)
+        else:
+            self._push_pointer(source, source_val)
+        self._store(destination, val)
+        return None
+
     def _pop_pointer(self, destination, val):
         # use source to swith between pointer destinations
         if destination == 'pointer':
@@ -338,17 +564,21 @@ class CodeWriter:
         ])
 
     def _pop_method_level(self, destination, val):
+        # stepping to the address takes 6 + val instructions with the pop,
+        # against 13 for _pop_indexed, so this is used up to val = 7
         pop_dict = {
             'local': 'LCL',
             'argument': 'ARG',
             'this': 'THIS',
             'that': 'THAT'
         }
-        address_increment = ['A=A+1'] * int(val)
+        if int(val) == 0:
+            address_increment = ['A=M']
+        else:
+            address_increment = ['A=M+1'] + ['A=A+1'] * (int(val) - 1)
 
         self.lines.extend([
-            '@{}'.format(pop_dict[destination]),
-            'A=M'
+            '@{}'.format(pop_dict[destination])
         ] +
             address_increment +
             [
@@ -357,8 +587,34 @@ class CodeWriter:
 
         return None
 
+    def _pop_indexed(self, destination, val):
+        pop_dict = {
+            'local': 'LCL',
+            'argument': 'ARG',
+            'this': 'THIS',
+            'that': 'THAT'
+        }
+        # store the destination address in R13, pop, then store through it
+        self.lines.extend([
+            '@{}'.format(pop_dict[destination]),
+            'D=M',
+            '@{}'.format(val),
+            'D=D+A',
+            '@R13',
+            'M=D',
+            '@SP',
+            'M=M-1',
+            'A=M',
+            'D=M',
+            '@R13',
+            'A=M',
+            'M=D'
+        ])
+        return None
+
     def _label(self, line):
         label = line.arg1
+        self._flush()
         self.lines.extend([
             '({})'.format(label)
         ])
@@ -366,6 +622,7 @@ class CodeWriter:
 
     def _goto(self, line):
         destination = line.arg1
+        self._flush()
 
         self.lines.extend([
             '@{}'.format(destination),
@@ -383,8 +640,20 @@ class CodeWriter:
         ])
         return None
 
+    def _if_zero(self, line):
+        ''' if-goto taken when the top of stack is 0, for the if_zero
+        command VMOptimizer writes
+        '''
+        self._pop(None)
+        self.lines.extend([
+            '@{}'.format(line.arg1),
+            'D;JEQ'
+        ])
+        return None
+
     def _function(self, line):
         name, num_local = line.arg1, line.arg2
+        self._flush()
         # for num_local, initialize to 0 and increment pointer
         increment_to_new_sp = ['M=0\nA=A+1' for i in range(int(num_local))]
         self.lines.extend([
@@ -400,7 +669,36 @@ class CodeWriter:
         ])
         return None
 
+    def _write_shared_routine(self, name, write_body):
+        ''' Write the routine labelled name the first time it is needed,
+        with a jump around it so the code it lands in runs on unchanged
+        '''
+        if name in self.shared_routines:
+            return None
+        self.shared_routines.add(name)
+        self.lines.extend([
+            '@{}_END'.format(name),
+            '0;JMP',
+            '({})'.format(name)
+        ])
+        write_body()
+        self.lines.append('({}_END)'.format(name))
+        return None
+
     def _return(self, line):
+        self._flush()
+        if not self.shared_calls:
+            self._write_return_body()
+            return None
+
+        self._write_shared_routine('$$RETURN', self._write_return_body)
+        self.lines.extend([
+            '@$$RETURN',
+            '0;JMP'
+        ])
+        return None
+
+    def _write_return_body(self):
         # get value from top of stack and put it in ARG[0]
         # then set SP to *ARG[1]
         self.lines.extend([
@@ -417,11 +715,8 @@ class CodeWriter:
 
         # push the return address to retrieve after pointers are reset
         # leave stack pointer pointing at return address
+        self._frame_address(5)
         self.lines.extend([
-            '@LCL',
-            'A=M'] +
-            ['A=A-1' for i in range(5)] +
-            [
             'D=M',
             '@SP',
             'A=M',
@@ -430,12 +725,8 @@ class CodeWriter:
 
         # reset other pointers in reverse stack order: THAT, THIS, ARG, LCL
         for i, source in enumerate(['THAT', 'THIS', 'ARG', 'LCL']):
+            self._frame_address(i + 1)
             self.lines.extend([
-                '@LCL',
-                'A=M'
-                ] +
-                ['A=A-1' for i in range(i+1)] +
-                [
                 'D=M',
                 '@{}'.format(source),
                 'M=D'
@@ -450,6 +741,22 @@ class CodeWriter:
         ])
         return None
 
+    def _frame_address(self, offset):
+        ''' Point A at LCL - offset, in the frame a call saved. Stepping
+        down costs offset + 1 instructions and subtracting costs 4, so steps
+        are used up to offset 2
+        '''
+        if offset <= 2:
+            self.lines.extend(['@LCL', 'A=M-1'] + ['A=A-1'] * (offset - 1))
+        else:
+            self.lines.extend([
+                '@LCL',
+                'D=M',
+                '@{}'.format(offset),
+                'A=D-A'
+            ])
+        return None
+
     def _call(self, line):
         name, num_args = line.arg1, int(line.arg2)
         # if there are no args, set num. args to 1 to leave room on stack
@@ -457,6 +764,12 @@ class CodeWriter:
         if num_args == 0:
             self._write_custom_line('push',  'constant', '0')
             num_args = 1
+        self._flush()
+
+        # the bootstrap keeps its inline call, with the Sys.init workaround
+        if self.shared_calls and name != 'Sys.init':
+            self._shared_call(name, num_args)
+            return None
 
         # provide returnAddress. store on top of stack and
         self.lines.extend([
@@ -474,15 +787,13 @@ class CodeWriter:
             self._get_and_stack_pointer(source)
 
         # set new pointers for ARG and LCL
-        decrement_to_args = ['D=D-1' for i in range(num_args + 5)]
         self.lines.extend([
             'D=M',
             '@LCL',
             'M=D',
-            '@ARG'
-            ] +
-            decrement_to_args +
-            [
+            '@{}'.format(num_args + 5),
+            'D=D-A',
+            '@ARG',
             'M=D'
         ])
 
@@ -509,6 +820,63 @@ class CodeWriter:
         self.num_calls += 1
         return None
 
+    def _shared_call(self, name, num_args):
+        ''' Call through $$CALL: R13 holds num_args + 5, R14 the address of
+        the function and D the return address
+        '''
+        self._write_shared_routine('$$CALL', self._write_call_body)
+        self.lines.extend([
+            '@{}'.format(num_args + 5),
+            'D=A',
+            '@R13',
+            'M=D',
+            '@{}'.format(name),
+            'D=A',
+            '@R14',
+            'M=D',
+            '@CALL{}'.format(self.num_calls),
+            'D=A',
+            '@$$CALL',
+            '0;JMP',
+            '(CALL{})'.format(self.num_calls)
+        ])
+        self.num_calls += 1
+        return None
+
+    def _write_call_body(self):
+        # push the return address, held in D, then the caller's pointers
+        self.lines.extend([
+            '@SP',
+            'AM=M+1',
+            'A=A-1',
+            'M=D'
+        ])
+        for source in ['LCL', 'ARG', 'THIS', 'THAT']:
+            self.lines.extend([
+                '@{}'.format(source),
+                'D=M',
+                '@SP',
+                'AM=M+1',
+                'A=A-1',
+                'M=D'
+            ])
+
+        # LCL = SP, ARG = SP - (num_args + 5), then jump to the function
+        self.lines.extend([
+            '@SP',
+            'D=M',
+            '@LCL',
+            'M=D',
+            '@R13',
+            'D=D-M',
+            '@ARG',
+            'M=D',
+            '@R14',
+            'A=M',
+            '0;JMP'
+        ])
+        return None
+
     def _get_and_stack_pointer(self, source):
         self.lines.extend([
             '@{}'.format(source),
@@ -537,26 +905,69 @@ def read_file(file):
     return lines, file
 
 
-def translate_lines(lines, writer=None):
+def translate_lines(lines, writer=None, optimize_vm=False):
     new_lines = []
     parser = Parser()
     if writer is None:
         writer = CodeWriter()
 
-    for line in lines:
-        if not line or line[:2] == '//':
-            continue
-        # print(line)
-        parsed_line = parser.parse(line)
-        # print(parsed_line)
+    parsed_lines = [
+        parser.parse(line) for line in lines if line and line[:2] != '//'
+    ]
+    if optimize_vm:
+        commands = optimize_commands([
+            (line.command_type, line.arg1, line.arg2) for line in parsed_lines
+        ])
+        parsed_lines = [make_line(*command) for command in commands]
+
+    for parsed_line in parsed_lines:
         translated_line = writer.write_code(parsed_line)
-        # print(translated_line)
-        # print()
         new_lines.append(translated_line)
 
+    finish_line = writer.finish()
+    if finish_line:
+        new_lines.append(finish_line)
     return new_lines
 
 
+def make_line(command_type, arg1, arg2):
+    line = Parser.Line()
+    line.command_type = command_type
+    line.arg1 = arg1
+    line.arg2 = arg2
+    return line
+
+
+def translate_directory(path, optimize_vm=False, **writer_options):
+    ''' Translate every .vm file in the directory at path into one program,
+    starting with the bootstrap code. writer_options go to CodeWriter
+    '''
+    agg_writer = CodeWriter(**writer_options)
+    files = [str(f) for f in path.glob('*.vm')]
+    # print(files)
+    translated_lines_agg = []
+
+    if 'Sys.vm' in files:
+        file = path / 'Sys.vm'
+        filename = 'Sys'
+        agg_writer.static_name = filename
+        translated_lines_agg.append('\n// {}\n'.format(filename))
+        lines, file = read_file(file)
+        translated_lines = translate_lines(lines, agg_writer, optimize_vm)
+        translated_lines_agg.extend(translated_lines)
+
+    files = sorted(file for file in files if file != 'Sys.vm')
+    for file in files:
+        filename = Path(file).stem
+        agg_writer.static_name = filename
+        translated_lines_agg.append('\n// {}\n'.format(file))
+        lines, file = read_file(file)
+        translated_lines = translate_lines(lines, agg_writer, optimize_vm)
+        translated_lines_agg.extend(translated_lines)
+
+    return translated_lines_agg
+
+
 def write_file(lines, filename):
     big_word = '\n'.join(lines)
 
@@ -564,42 +975,56 @@ def write_file(lines, filename):
         f.write(big_word)
 
 
+def parse_args():
+    arg_parser = argparse.ArgumentParser(
+        description='Translate VM code into Hack assembly')
+    arg_parser.add_argument('input', help='a .vm file or a directory of them')
+    arg_parser.add_argument('-O', dest='optimize', action='store_true',
+                            help='run the peephole optimizer over the '
+                                 'assembly')
+    arg_parser.add_argument('--shared-calls', action='store_true',
+                            help='call and return through one shared copy '
+                                 'of their code, passing parameters in '
+                                 'R13-R15')
+    arg_parser.add_argument('--shared-comparisons', action='store_true',
+                            help='compute eq, gt and lt in one shared '
+                                 'routine each, returning through R15')
+    arg_parser.add_argument('--optimize-vm', action='store_true',
+                            help='fold constants, turn push/pop pairs into '
+                                 'moves and drop unreachable commands '
+                                 'before translating')
+    arg_parser.add_argument('--cache-top', action='store_true',
+                            help='keep the top of the stack in D while '
+                                 'it can be')
+    return arg_parser.parse_args()
+
+
 if __name__ == '__main__':
-    arg = sys.argv[1]
+    args = parse_args()
+    arg = args.input
     if arg[-3:] == '.vm':
         lines, file = read_file(arg)
-        writer = CodeWriter()
+        writer = CodeWriter(shared_calls=args.shared_calls,
+                            shared_comparisons=args.shared_comparisons,
+                            cache_top=args.cache_top)
         writer.bootstrapped = True
-        translated_lines = translate_lines(lines, writer)
+        translated_lines = translate_lines(lines, writer, args.optimize_vm)
         file = file.split('.vm')[0] + '.asm'
     else:
-        agg_writer = CodeWriter()
         path = Path(arg).resolve()
-        files = [str(f) for f in path.glob('*.vm')]
-        # print(files)
-        translated_lines_agg = []
-
-        if 'Sys.vm' in files:
-            file = path / 'Sys.vm'
-            filename = 'Sys'
-            agg_writer.static_name = filename
-            translated_lines_agg.append('\n// {}\n'.format(filename))
-            lines, file = read_file(file)
-            translated_lines = translate_lines(lines, agg_writer)
-            translated_lines_agg.extend(translated_lines)
-
-        files = sorted(file for file in files if file != 'Sys.vm')
-        for file in files:
-            filename = Path(file).stem
-            agg_writer.static_name = filename
-            translated_lines_agg.append('\n// {}\n'.format(file))
-            lines, file = read_file(file)
-            translated_lines = translate_lines(lines, agg_writer)
-            translated_lines_agg.extend(translated_lines)
-
-        translated_lines = translated_lines_agg
+        translated_lines = translate_directory(
+            path, optimize_vm=args.optimize_vm,
+            shared_calls=args.shared_calls,
+            shared_comparisons=args.shared_comparisons,
+            cache_top=args.cache_top)
 
         filename = path.name + '.asm'
         file = path / filename
     print(file)
+    if args.optimize:
+        rom_before = count_instructions(translated_lines)
+        translated_lines = optimize(translated_lines, args.cache_top)
+        rom_after = count_instructions(translated_lines)
+        print('ROM: {} -> {} instructions ({:.1%} smaller)'.format(
+            rom_before, rom_after, 1 - rom_after / rom_before))
     write_file(translated_lines, file)
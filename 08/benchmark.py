@@ -0,0 +1,401 @@
+# Code size and cycle benchmarks for the VM translator. Run from this
+# directory:
+#   python benchmark.py
+from pathlib import Path
+import shutil
+import sys
+import tempfile
+
+from Peephole import count_instructions, optimize, split_lines
+from VMTranslator import translate_directory
+
+repo = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(repo / '06'))
+sys.path.insert(0, str(repo / '10_11'))
+from HackAssembler import Assembler  # noqa: E402
+from HackSimulator import HackSimulator  # noqa: E402
+from JackCompiler import compile_file  # noqa: E402
+
+# a small self-contained program: recursion, loops, comparisons and memory
+# segments, with no calls into the Jack OS
+fib_program = {
+    'Sys.vm': '''function Sys.init 2
+push constant 18
+call Main.fib 1
+pop local 0
+push constant 300
+push constant 200
+call Main.mul 2
+pop local 1
+label sysloop
+goto sysloop
+''',
+    'Main.vm': '''function Main.fib 0
+push argument 0
+push constant 2
+lt
+if-goto fibbase
+push argument 0
+push constant 1
+sub
+call Main.fib 1
+push argument 0
+push constant 2
+sub
+call Main.fib 1
+add
+return
+label fibbase
+push argument 0
+return
+function Main.mul 2
+push constant 0
+pop local 0
+push argument 1
+pop local 1
+label mulloop
+push local 1
+push constant 0
+eq
+if-goto mulend
+push local 0
+push argument 0
+add
+pop local 0
+push local 1
+push constant 1
+sub
+pop local 1
+goto mulloop
+label mulend
+push local 0
+return
+''',
+}
+
+
+# deep segment indexes and many arguments, in a loop
+wide_program = {
+    'Sys.vm': '''function Sys.init 2
+push constant 0
+pop local 0
+push constant 500
+pop local 1
+label wideloop
+push local 1
+push constant 0
+eq
+if-goto wideend
+{pushes}
+call Wide.sum 12
+push local 0
+add
+pop local 0
+push local 1
+push constant 1
+sub
+pop local 1
+goto wideloop
+label wideend
+label sysloop
+goto sysloop
+'''.format(pushes='\n'.join(
+        'push constant {}'.format(n) for n in range(12))),
+    'Wide.vm': '''function Wide.sum 20
+push argument 11
+pop local 19
+push argument 10
+pop local 15
+push local 19
+push local 15
+add
+pop local 12
+push local 12
+return
+''',
+}
+
+
+# constant expressions, zero tests, moves and unreachable code, as the Jack
+# compiler writes them
+fold_program = {
+    'Sys.vm': '''function Sys.init 2
+push constant 0
+pop local 0
+push constant 1000
+pop local 1
+label foldloop
+push local 1
+push constant 0
+eq
+not
+if-goto foldbody
+goto foldend
+push constant 99
+pop local 0
+label foldbody
+push constant 30
+push constant 12
+add
+push constant 8
+sub
+push local 0
+add
+pop local 0
+push local 0
+pop temp 1
+push temp 1
+pop local 0
+push local 1
+push constant 0
+eq
+if-goto foldend
+push local 1
+push constant 1
+sub
+pop local 1
+goto foldloop
+label foldend
+label sysloop
+goto sysloop
+return
+''',
+}
+
+
+# push and binary operator sequences, the shapes the peephole rewrites,
+# leaving ((7 + 1 - 5) | (7 & 5)) negated and inverted, and 5 + 6
+stack_program = {
+    'Sys.vm': '''function Sys.init 2
+push constant 7
+pop local 0
+push constant 5
+pop local 1
+push local 0
+push constant 1
+add
+push local 1
+sub
+push local 0
+push local 1
+and
+or
+neg
+not
+pop local 0
+push local 0
+push constant 1
+sub
+push local 0
+add
+pop local 1
+label sysloop
+goto sysloop
+''',
+}
+stack_results = [6, 11]
+
+
+# Jack code run from a hand written Sys.init. Its names start with keywords
+# and some are separated by tabs, which the tokenizer has to read as whole
+# identifiers, and its string constants spell symbols, which the parser must
+# not take for those symbols. The only OS calls are the ones string
+# constants compile to, stood in for by a String that keeps just the last
+# character appended
+jack_program = {
+    'Sys.vm': '''function Sys.init 2
+call Main.run 0
+pop local 0
+push constant 8000
+push constant 25
+call Main.charAt 2
+pop local 1
+label sysloop
+goto sysloop
+''',
+    'String.vm': '''function String.new 0
+push constant 0
+return
+function String.appendChar 0
+push argument 1
+return
+''',
+    'Main.jack': '''class Main {
+\tstatic int\treturnValue;
+
+\tfunction int charAt(Array s, int i) {
+\t\treturn s[i];
+\t}
+
+\tfunction void keep(int c) {
+\t\tlet returnValue = returnValue + c;
+\t\treturn;
+\t}
+
+\tfunction int semicolon() {
+\t\treturn ";";
+\t}
+
+\tfunction int run() {
+\t\tvar Array letter;
+\t\tvar int\tdone, variable, classic;
+\t\tlet letter = 8000;
+\t\tlet variable = 0;
+\t\tlet done = false;
+\t\twhile (~done) {
+\t\t\tlet letter[variable] = variable + 65;
+\t\t\tlet variable = variable + 1;
+\t\t\tlet done = variable > 25;
+\t\t}
+\t\tlet classic = 0;
+\t\tlet variable = 0;
+\t\twhile (variable < 26) {
+\t\t\tlet classic = classic + Main.charAt(letter, variable);
+\t\t\tlet variable = variable + 1;
+\t\t}
+\t\tlet returnValue = classic;
+\t\tdo Main.keep(")");
+\t\tdo Main.keep(Main.semicolon());
+\t\treturn returnValue;
+\t}
+}
+''',
+}
+
+# what jack_program leaves in the locals of Sys.init: the sum of the
+# letters A to Z, ) and ;, and the letter Z
+jack_results = [2115, 90]
+
+
+def write_program(directory, name, program):
+    path = Path(directory) / name
+    path.mkdir()
+    for filename, source in program.items():
+        (path / filename).write_text(source)
+    return path
+
+
+def make_fib_program(directory):
+    return write_program(directory, 'Fib', fib_program)
+
+
+def make_wide_program(directory):
+    return write_program(directory, 'Wide', wide_program)
+
+
+def make_fold_program(directory):
+    return write_program(directory, 'Fold', fold_program)
+
+
+def make_stack_program(directory):
+    return write_program(directory, 'Stack', stack_program)
+
+
+def make_jack_program(directory):
+    path = write_program(directory, 'Jack', jack_program)
+    compile_file(path / 'Main.jack')
+    return path
+
+
+def make_tetris_program(directory):
+    ''' Compile the Tetris sources in 09/ to VM code. The program calls the
+    Jack OS, which is not part of this repository, so it can be translated
+    and assembled but not run
+    '''
+    path = Path(directory) / 'Tetris'
+    path.mkdir()
+    for source in sorted((repo / '09').glob('*.jack')):
+        compile_file(Path(shutil.copy(str(source), str(path))))
+    return path
+
+
+# translation settings compared by the benchmarks: CodeWriter options and
+# whether the peephole optimizer runs
+modes = {
+    'plain': ({}, False),
+    '-O': ({}, True),
+    'shared': ({'shared_calls': True}, False),
+    'shared -O': ({'shared_calls': True}, True),
+    'compare': ({'shared_comparisons': True}, False),
+    'all -O': ({'shared_calls': True, 'shared_comparisons': True}, True),
+    'cached': ({'cache_top': True}, False),
+    'cached -O': ({'cache_top': True}, True),
+    'vm': ({'optimize_vm': True}, False),
+    'vm cached -O': ({'optimize_vm': True, 'cache_top': True}, True),
+}
+
+
+def translate(path, mode):
+    writer_options, optimized = modes[mode]
+    lines = translate_directory(path, **writer_options)
+    if not optimized:
+        return lines
+    return optimize(lines, writer_options.get('cache_top', False))
+
+
+def count_labels(lines):
+    ''' number of labels the assembler has to resolve in lines '''
+    return sum(1 for line in split_lines(lines) if line[:1] == '(')
+
+
+def bench_rom(programs):
+    ''' Report the ROM size and label count of each program in every mode,
+    against plain translation
+    '''
+    print('ROM size:')
+    for path in programs:
+        lines = translate(path, 'plain')
+        plain, plain_labels = count_instructions(lines), count_labels(lines)
+        print('  {:<8} {:<12} {:>7} instructions {:>7} {:>5} labels'.format(
+            path.name, 'plain', plain, '', plain_labels))
+        for mode in list(modes)[1:]:
+            lines = translate(path, mode)
+            size, labels = count_instructions(lines), count_labels(lines)
+            print('  {:<8} {:<12} {:>7} instructions {:+7.1%} {:>5} labels'
+                  .format('', mode, size, size / plain - 1, labels))
+    return None
+
+
+def run_program(lines, limit=10 ** 8):
+    ''' Assemble and run translated lines until the program halts. Return
+    the instructions executed and the locals of Sys.init, where the
+    benchmark programs leave their results
+    '''
+    simulator = HackSimulator(Assembler().assemble(split_lines(lines)))
+    cycles = simulator.run(limit)
+    lcl = simulator.ram[1]
+    return cycles, list(simulator.ram[lcl:lcl + 2])
+
+
+def bench_cycles(programs):
+    ''' Run each program in every mode, check they all compute the same
+    results, and report the instructions executed against plain translation
+    '''
+    print('cycles:')
+    for path in programs:
+        plain, results = run_program(translate(path, 'plain'))
+        print('  {:<8} {:<12} {:>9} instructions'.format(
+            path.name, 'plain', plain))
+        for mode in list(modes)[1:]:
+            cycles, mode_results = run_program(translate(path, mode))
+            assert mode_results == results, \
+                '{} disagrees with plain'.format(mode)
+            print('  {:<8} {:<12} {:>9} instructions {:+7.1%}'.format(
+                '', mode, cycles, cycles / plain - 1))
+    return None
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as directory:
+        fib = make_fib_program(directory)
+        wide = make_wide_program(directory)
+        fold = make_fold_program(directory)
+        stack = make_stack_program(directory)
+        assert run_program(translate(stack, 'cached -O'))[1] == stack_results, \
+            'cached -O computed the wrong results'
+        jack = make_jack_program(directory)
+        assert run_program(translate(jack, 'plain'))[1] == jack_results, \
+            'compiled Jack program computed the wrong results'
+        bench_rom([fib, wide, fold, stack, jack,
+                   make_tetris_program(directory)])
+        bench_cycles([fib, wide, fold, stack, jack])
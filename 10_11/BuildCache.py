@@ -0,0 +1,86 @@
+# Developed for project 10 of nand2tetris course
+from pathlib import Path
+import hashlib
+import json
+
+
+def file_digest(path):
+    ''' sha256 hex digest of a file's contents '''
+    with open(str(path), 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class BuildCache:
+    ''' On-disk record of the outputs built from each source file in a
+    directory. An entry is up to date while the source content hash, the tool
+    version and the build options match and its outputs are untouched since
+    they were written. Entries from another tool version are dropped on load
+    '''
+    def __init__(self, directory, version, filename='.jackcache.json'):
+        self.path = Path(directory) / filename
+        self.version = version
+        self.entries = {}
+        self._load()
+        return None
+
+    def _load(self):
+        try:
+            with open(str(self.path)) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if cache.get('version') == self.version:
+            self.entries = cache.get('entries', {})
+        return None
+
+    def save(self):
+        with open(str(self.path), 'w') as f:
+            json.dump({'version': self.version, 'entries': self.entries}, f,
+                      indent=1, sort_keys=True)
+        return None
+
+    def is_fresh(self, source, digest, outputs, options):
+        ''' True if outputs were built from this exact source content with
+        the same options and have not changed since
+        '''
+        entry = self.entries.get(source.name)
+        if not entry:
+            return False
+        if entry['digest'] != digest or entry['options'] != options:
+            return False
+        if set(entry['outputs']) != {output.name for output in outputs}:
+            return False
+        for output in outputs:
+            stamp = self._stamp(output)
+            if stamp is None or entry['outputs'][output.name] != stamp:
+                return False
+        return True
+
+    def record(self, source, digest, outputs, options):
+        self.entries[source.name] = {
+            'digest': digest,
+            'options': options,
+            'outputs': {output.name: self._stamp(output) for output in outputs},
+        }
+        return None
+
+    def discard(self, source):
+        self.entries.pop(source.name, None)
+        return None
+
+    def prune(self, sources):
+        ''' drop entries for source files that no longer exist '''
+        names = {source.name for source in sources}
+        for name in list(self.entries):
+            if name not in names:
+                del self.entries[name]
+        return None
+
+    def _stamp(self, output):
+        ''' size and modification time of an output, or None if missing '''
+        try:
+            stat = output.stat()
+        except OSError:
+            return None
+        return [stat.st_size, stat.st_mtime_ns]
@@ -1,21 +1,172 @@
 # Developed for project 10 of nand2tetris course
-from JackParser import Parser
+from BuildCache import BuildCache, file_digest
+from JackParser import engines
 from JackTokenizer import Tokenizer
 
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+import argparse
+import hashlib
+import logging
 import sys
+import time
+import traceback
+
+
+# subsystems that can be traced from the command line, and their loggers
+trace_loggers = {
+    'parser': 'JackParser',
+    'symbols': 'SymbolTable',
+}
+
+
+def parse_args():
+    arg_parser = argparse.ArgumentParser(
+        description='Parse every .jack file in a directory into XML')
+    arg_parser.add_argument('input', help='directory of .jack files')
+    arg_parser.add_argument('--xml', action='store_true',
+                            help='also write the token stream of each file '
+                                 'to <name>T.xml')
+    arg_parser.add_argument('--engine', choices=sorted(engines),
+                            default='legacy', help='parser engine to use')
+    arg_parser.add_argument('--stream', action='store_true',
+                            help='write each declaration as soon as it is '
+                                 'parsed instead of holding the whole tree')
+    arg_parser.add_argument('--jobs', '-j', type=int, default=1,
+                            help='number of files to analyze in parallel')
+    arg_parser.add_argument('--trace', action='append', default=[],
+                            choices=sorted(trace_loggers),
+                            help='print debug traces of a subsystem to '
+                                 'stderr. May be given more than once')
+    arg_parser.add_argument('--no-cache', action='store_true',
+                            help='rebuild every file, ignoring the build '
+                                 'cache')
+    return arg_parser.parse_args()
+
+
+def configure_tracing(subsystems):
+    ''' turn on debug tracing for the named subsystems. Also run in each
+    worker process, which does not inherit the logging setup under spawn
+    '''
+    if subsystems:
+        logging.basicConfig(format='%(name)s: %(message)s')
+    for subsystem in subsystems:
+        logging.getLogger(trace_loggers[subsystem]).setLevel(logging.DEBUG)
+    return None
+
+
+def tool_version():
+    ''' hash of the analyzer's own sources, so cached outputs are rebuilt
+    whenever the tool changes
+    '''
+    tool_hash = hashlib.sha256()
+    tool_directory = Path(__file__).resolve().parent
+    for module in ('JackAnalyzer', 'JackParser', 'JackTokenizer', 'SymbolTable'):
+        with open(str(tool_directory / (module + '.py')), 'rb') as f:
+            tool_hash.update(f.read())
+    return tool_hash.hexdigest()
+
+
+def output_paths(file, xml=False):
+    outputs = [file.with_name(file.stem + '.xml')]
+    if xml:
+        outputs.append(file.with_name(file.stem + 'T.xml'))
+    return outputs
+
+
+def analyze_file(file, engine='legacy', stream=False, xml=False):
+    ''' Tokenize and parse one .jack file, writing <name>.xml next to it.
+    Return the file, the time it took and the formatted traceback of any
+    error, so results can be collected from worker processes
+    '''
+    start = time.perf_counter()
+    error = None
+    try:
+        outputs = output_paths(file, xml)
+        output_path = str(outputs[0])
+
+        if xml:
+            Tokenizer(input_file=str(file)).tokenize(str(outputs[1]))
+
+        tokenizer = Tokenizer(input_file=str(file)).tokenize()
+
+        parser = engines[engine](tokenizer)
+        parser.parse_to_file(output_path, stream=stream)
+    except Exception:
+        error = traceback.format_exc()
+
+    return file, time.perf_counter() - start, error
+
+
+def analyze_files(files, jobs=1, trace=(), **options):
+    ''' Analyze files one after another, or across a pool of jobs worker
+    processes. Results come back in the order of files either way
+    '''
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs,
+                                 initializer=configure_tracing,
+                                 initargs=(trace,)) as executor:
+            futures = [
+                executor.submit(analyze_file, file, **options)
+                for file in files
+            ]
+            for future in futures:
+                yield future.result()
+    else:
+        for file in files:
+            yield analyze_file(file, **options)
+    return None
+
+
+def report_timings(results, wall_seconds):
+    print('\nper-file timing:')
+    for file, seconds, error in results:
+        status = 'FAILED' if error else 'ok'
+        print('  {:>8.3f} s  {:<6} {}'.format(seconds, status, file.name))
+    print('  {:>8.3f} s  total'.format(sum(result[1] for result in results)))
+    print('  {:>8.3f} s  wall clock'.format(wall_seconds))
+    return None
+
 
 if __name__ == '__main__':
-    input_arg = sys.argv[1]
+    args = parse_args()
+    configure_tracing(args.trace)
 
-    input_path = Path(input_arg).resolve()
+    input_path = Path(args.input).resolve()
 
-    files = input_path.glob('*.jack')
+    files = sorted(input_path.glob('*.jack'))
+    start = time.perf_counter()
+
+    # skip files whose outputs are up to date with their current content
+    cache = BuildCache(input_path, tool_version())
+    options = {'engine': args.engine, 'xml': args.xml}
+    digests = {file: file_digest(file) for file in files}
+    stale_files = [
+        file for file in files
+        if args.no_cache or not cache.is_fresh(
+            file, digests[file], output_paths(file, args.xml), options)
+    ]
     for file in files:
+        if file not in stale_files:
+            print('{} (up to date)'.format(file))
+
+    results = []
+    for result in analyze_files(stale_files, jobs=args.jobs,
+                                trace=args.trace, engine=args.engine,
+                                stream=args.stream, xml=args.xml):
+        file, seconds, error = result
         print(file)
-        output_path = str(file.with_name(file.stem + '.xml'))
+        if error:
+            print(error, file=sys.stderr)
+            cache.discard(file)
+        else:
+            cache.record(file, digests[file], output_paths(file, args.xml),
+                         options)
+        results.append(result)
 
-        tokenizer = Tokenizer(input_file=str(file)).tokenize()
+    cache.prune(files)
+    cache.save()
 
-        parser = Parser(tokenizer)
-        parser.parse_to_file(output_path)
+    report_timings(results, time.perf_counter() - start)
+    if any(error for _, _, error in results):
+        sys.exit(1)
@@ -0,0 +1,316 @@
+# Developed for project 11 of nand2tetris course, to compile Jack classes
+# into VM code for 08/VMTranslator.py
+from JackParser import DescentParser
+from JackTokenizer import Tokenizer
+from SymbolTable import SymbolTable
+from VMWriter import VMWriter
+
+from pathlib import Path
+import argparse
+
+# VM segment holding each kind of variable
+segments = {
+    'static': 'static',
+    'field': 'this',
+    'argument': 'argument',
+    'var': 'local',
+}
+
+binary_commands = {
+    '+': 'add',
+    '-': 'sub',
+    '&': 'and',
+    '|': 'or',
+    '<': 'lt',
+    '>': 'gt',
+    '=': 'eq',
+}
+
+# binary operators implemented by the OS Math class
+math_calls = {
+    '*': 'Math.multiply',
+    '/': 'Math.divide',
+}
+
+unary_commands = {
+    '-': 'neg',
+    '~': 'not',
+}
+
+
+class CodeGenerator:
+    ''' Parser sink that compiles a class to VM code. Parser hands over each
+    class-level node as soon as it closes, so every subroutine is written out
+    and dropped right after it has been parsed, and only one subroutine tree
+    is held at a time
+    '''
+    def __init__(self, filename):
+        self.writer = VMWriter(filename)
+        self.class_name = None
+        self.class_table = None
+        self.table = None
+        self.subroutine_name = None
+        self.num_labels = 0
+        return None
+
+    # sink interface used by Parser in stream mode
+    def open_class(self, node):
+        return None
+
+    def write_child(self, node):
+        if node.tag == 'identifier' and self.class_name is None:
+            self.class_name = node.text
+            self.class_table = SymbolTable(self.class_name)
+        elif node.tag == 'classVarDec':
+            self._compile_class_var_dec(node)
+        elif node.tag == 'subroutineDec':
+            self._compile_subroutine(node)
+        return None
+
+    def close_class(self, node):
+        self.writer.close()
+        return None
+
+    # declarations
+    def _declare_names(self, table, nodes, type, kind):
+        ''' declare each identifier in nodes, skipping the commas between
+        them
+        '''
+        for node in nodes:
+            if node.tag == 'identifier':
+                table.new_symbol(node.text, type, kind)
+        return None
+
+    def _compile_class_var_dec(self, node):
+        children = list(node)
+        kind, type = children[0].text, children[1].text
+        self._declare_names(self.class_table, children[2:], type, kind)
+        return None
+
+    def _compile_subroutine(self, node):
+        children = list(node)
+        subroutine_type = children[0].text
+        self.subroutine_name = children[2].text
+        self.table = SymbolTable(self.subroutine_name, self.class_table)
+        self.num_labels = 0
+
+        # the object a method is called on arrives as argument 0
+        if subroutine_type == 'method':
+            self.table.new_symbol('this', self.class_name, 'argument')
+
+        parameters = [child for child in children[4] if child.text != ',']
+        for type, name in zip(parameters[0::2], parameters[1::2]):
+            self.table.new_symbol(name.text, type.text, 'argument')
+
+        body = list(children[6])
+        for var_dec in body[1:-2]:
+            var_children = list(var_dec)
+            self._declare_names(self.table, var_children[2:-1],
+                                var_children[1].text, 'var')
+
+        self.writer.write_function(
+            '{}.{}'.format(self.class_name, self.subroutine_name),
+            self.table.var_count('var')
+        )
+        if subroutine_type == 'constructor':
+            self.writer.write_push('constant', self.class_table.var_count('field'))
+            self.writer.write_call('Memory.alloc', 1)
+            self.writer.write_pop('pointer', 0)
+        elif subroutine_type == 'method':
+            self.writer.write_push('argument', 0)
+            self.writer.write_pop('pointer', 0)
+
+        self._compile_statements(body[-2])
+        return None
+
+    # statements
+    def _new_label(self, name):
+        ''' labels are global in the VM translator, so qualify them with the
+        subroutine they belong to
+        '''
+        label = '{}.{}${}{}'.format(
+            self.class_name, self.subroutine_name, name, self.num_labels)
+        self.num_labels += 1
+        return label
+
+    def _compile_statements(self, node):
+        statement_switch = {
+            'letStatement': self._compile_let,
+            'ifStatement': self._compile_if,
+            'whileStatement': self._compile_while,
+            'doStatement': self._compile_do,
+            'returnStatement': self._compile_return,
+        }
+        for statement in node:
+            statement_switch[statement.tag](list(statement))
+        return None
+
+    def _compile_let(self, children):
+        symbol = self.table[children[1].text]
+        if children[2].text == '[':
+            # let a[i] = x: address a + i goes to THAT once x is evaluated
+            self._push_variable(symbol)
+            self._compile_expression(children[3])
+            self.writer.write_arithmetic('add')
+            self._compile_expression(children[6])
+            self.writer.write_pop('temp', 0)
+            self.writer.write_pop('pointer', 1)
+            self.writer.write_push('temp', 0)
+            self.writer.write_pop('that', 0)
+        else:
+            self._compile_expression(children[3])
+            self.writer.write_pop(segments[symbol.kind], symbol.var_num)
+        return None
+
+    def _compile_if(self, children):
+        else_label = self._new_label('IF_ELSE')
+        end_label = self._new_label('IF_END')
+
+        self._compile_expression(children[2])
+        self.writer.write_arithmetic('not')
+        self.writer.write_if(else_label)
+        self._compile_statements(children[5])
+        self.writer.write_goto(end_label)
+        self.writer.write_label(else_label)
+        if len(children) > 7:
+            self._compile_statements(children[9])
+        self.writer.write_label(end_label)
+        return None
+
+    def _compile_while(self, children):
+        loop_label = self._new_label('WHILE_EXP')
+        end_label = self._new_label('WHILE_END')
+
+        self.writer.write_label(loop_label)
+        self._compile_expression(children[2])
+        self.writer.write_arithmetic('not')
+        self.writer.write_if(end_label)
+        self._compile_statements(children[5])
+        self.writer.write_goto(loop_label)
+        self.writer.write_label(end_label)
+        return None
+
+    def _compile_do(self, children):
+        self._compile_call(children[1:-1])
+        # discard the returned value
+        self.writer.write_pop('temp', 0)
+        return None
+
+    def _compile_return(self, children):
+        if len(children) > 2:
+            self._compile_expression(children[1])
+        else:
+            self.writer.write_push('constant', 0)
+        self.writer.write_return()
+        return None
+
+    # expressions
+    def _push_variable(self, symbol):
+        self.writer.write_push(segments[symbol.kind], symbol.var_num)
+        return None
+
+    def _compile_expression(self, node):
+        children = list(node)
+        self._compile_term(children[0])
+        for operator, term in zip(children[1::2], children[2::2]):
+            self._compile_term(term)
+            if operator.text in math_calls:
+                self.writer.write_call(math_calls[operator.text], 2)
+            else:
+                self.writer.write_arithmetic(binary_commands[operator.text])
+        return None
+
+    def _compile_term(self, node):
+        children = list(node)
+        first = children[0]
+
+        if first.tag == 'integerConstant':
+            self.writer.write_push('constant', first.text)
+        elif first.tag == 'stringConstant':
+            self.writer.write_push('constant', len(first.text))
+            self.writer.write_call('String.new', 1)
+            for character in first.text:
+                self.writer.write_push('constant', ord(character))
+                self.writer.write_call('String.appendChar', 2)
+        elif first.tag == 'keyword':
+            if first.text == 'this':
+                self.writer.write_push('pointer', 0)
+            else:
+                self.writer.write_push('constant', 0)
+                if first.text == 'true':
+                    self.writer.write_arithmetic('not')
+        elif first.text == '(':
+            self._compile_expression(children[1])
+        elif first.tag == 'symbol':
+            self._compile_term(children[1])
+            self.writer.write_arithmetic(unary_commands[first.text])
+        elif len(children) == 1:
+            self._push_variable(self.table[first.text])
+        elif children[1].text == '[':
+            self._push_variable(self.table[first.text])
+            self._compile_expression(children[2])
+            self.writer.write_arithmetic('add')
+            self.writer.write_pop('pointer', 1)
+            self.writer.write_push('that', 0)
+        else:
+            self._compile_call(children)
+        return None
+
+    def _compile_call(self, children):
+        ''' compile name(args), var.name(args) or Class.name(args) from the
+        nodes of the call
+        '''
+        if children[1].text == '.':
+            target, name = children[0].text, children[2].text
+            expression_list = children[4]
+            symbol = self.table.get(target)
+            if symbol is None:
+                # function or constructor of another class
+                function_name = '{}.{}'.format(target, name)
+                num_args = 0
+            else:
+                # method called on an object
+                self._push_variable(symbol)
+                function_name = '{}.{}'.format(symbol.type, name)
+                num_args = 1
+        else:
+            # method called on this object
+            self.writer.write_push('pointer', 0)
+            function_name = '{}.{}'.format(self.class_name, children[0].text)
+            expression_list = children[2]
+            num_args = 1
+
+        for expression in expression_list:
+            if expression.tag == 'expression':
+                self._compile_expression(expression)
+                num_args += 1
+        self.writer.write_call(function_name, num_args)
+        return None
+
+
+def compile_file(file):
+    ''' Compile one .jack file to a .vm file next to it '''
+    output_path = str(file.with_name(file.stem + '.vm'))
+    tokenizer = Tokenizer(input_file=str(file), engine='scan').tokenize()
+    DescentParser(tokenizer).parse_to_sink(CodeGenerator(output_path))
+    return output_path
+
+
+def parse_args():
+    arg_parser = argparse.ArgumentParser(
+        description='Compile Jack classes into VM code')
+    arg_parser.add_argument('input', help='a .jack file or a directory of them')
+    return arg_parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    input_path = Path(args.input).resolve()
+    if input_path.is_dir():
+        files = sorted(input_path.glob('*.jack'))
+    else:
+        files = [input_path]
+
+    for file in files:
+        print(compile_file(file))
@@ -1,54 +1,130 @@
 # Developed for project 10 of nand2tetris course
 from pathlib import Path
+import logging
 import re
 import sys
 from JackTokenizer import Tokenizer
 from SymbolTable import SymbolTable
-from JackTokenizer import Tokenizer
-from xml.etree.ElementTree import ElementTree, Element, SubElement, XML, dump, tostring, tostringlist
+from xml.etree.ElementTree import ElementTree, Element, SubElement, dump, tostring, tostringlist
 import xml.dom.minidom as minidom
 
+# parse tracing, off unless the JackParser logger is set to DEBUG
+logger = logging.getLogger('JackParser')
+
 subroutines = {'constructor', 'method', 'function'}
 types = {'char', 'boolean', 'int'}
 builtin_constants = {'false', 'true', 'null'}
+keyword_constants = builtin_constants | {'this'}
+statement_keywords = {'let', 'if', 'while', 'do', 'return'}
+binary_operators = set('+-*/&|<>=')
+unary_operators = set('-~')
+# token kinds whose values the descent engine matches against the grammar
+grammar_kinds = {'symbol', 'keyword'}
+# class-level nodes that are written out as soon as they close in stream mode
+streamed_declarations = {'classVarDec', 'subroutineDec'}
+
+
+class XMLStreamWriter:
+    ''' Write a class parse tree to file one top-level child at a time. The
+    output is byte-identical to Parser._dump_tree. It goes to a .part file
+    next to filename, which is renamed to filename once the class closes
+    '''
+    def __init__(self, filename):
+        self.path = Path(str(filename))
+        self.part_path = self.path.with_name(self.path.name + '.part')
+        self.output = open(str(self.part_path), 'w')
+        return None
+
+    def open_class(self, node):
+        self.output.write("<?xml version='1.0' encoding='utf8'?>\n")
+        self.output.write('<{}>'.format(node.tag))
+        return None
+
+    def write_child(self, node):
+        self.output.write(tostring(node, encoding='unicode'))
+        return None
+
+    def close_class(self, node):
+        self.output.write('</{}>'.format(node.tag))
+        self.output.close()
+        self.part_path.replace(self.path)
+        return None
+
+    def close(self):
+        ''' close the output if the class never closed, as when parsing
+        fails, and delete what was written of it
+        '''
+        if not self.output.closed:
+            self.output.close()
+            self.part_path.unlink()
+        return None
+
 
 class Parser:
     def __init__(self, tokenizer):
-        self.token_iter = self._process_tokenizer(tokenizer)
+        # tokenizer is an iterable of JackTokenizer.Token objects
+        self.token_iter = iter(tokenizer)
+        self.trace = logger.isEnabledFor(logging.DEBUG)
         self.input=None
         self.output = None
         self.depth = 0
         self.symbol_table = SymbolTable('global')
         self.tree = ElementTree()
         self.node_list = []
+        # bookkeeping for the open nodes in node_list, kept up to date by
+        # _open, _close and _add_new_token so no node has to be scanned:
+        # number of children and text of the last child of each open node,
+        # and how many open nodes carry each tag
+        self.child_counts = []
+        self.last_child_texts = []
+        self.open_tags = {}
+        # in stream mode, finished class-level nodes are handed to sink and
+        # dropped from the tree
+        self.sink = None
 
         return None
 
-    def _process_tokenizer(self, tokenizer):
-        # tokenizer_tokens = [token for token in tokenizer]
-        # no_marks = map(lambda s: s.strip('\'').strip(), tokenizer_tokens)
-        no_marks = map(lambda s: s.strip("'").strip(), tokenizer)
-        token_tree = XML(''.join(no_marks))
-        token_iter = token_tree.findall('.//')
-        return (token for token in token_iter)
-
     def _open_stream(self, filename):
         self.input = open(filename, 'r', encoding='utf-8')
         return None
 
-    def parse_to_file(self, output_path):
+    def parse_to_file(self, output_path, stream=False):
+        ''' parse all tokens and write the tree to output_path. With stream,
+        each classVarDec and subroutineDec is written as soon as it closes.
+        The tokenizer reads the source in chunks, so memory use then depends
+        on nesting depth and the number of class-level names instead of file
+        size
+        '''
+        if stream:
+            writer = XMLStreamWriter(output_path)
+            try:
+                self.parse_to_sink(writer)
+            finally:
+                writer.close()
+        else:
+            self._parse_tokens()
+            self._dump_tree(output_path)
+        return None
+
+    def parse_to_sink(self, sink):
+        ''' parse all tokens, handing each class-level node to sink as soon
+        as it is complete. sink provides open_class(node), write_child(node)
+        and close_class(node), like XMLStreamWriter
+        '''
+        self.sink = sink
+        self._parse_tokens()
+        return None
+
+    def _parse_tokens(self):
         for token in self.token_iter:
             self.parse(token)
-        self._dump_tree(output_path)
         return None
 
     def parse(self, token):
         # print(token)
         value, type = self._split_token(token)
 
-        if type == 'tokens':
-            return None
-        elif type == 'keyword':
+        if type == 'keyword':
             if value == 'class':
                 return self._compile_class()
             elif value in {'field', 'static'}:
@@ -298,7 +374,7 @@ class Parser:
         if not is_term and self.node_list[-1].tag == 'expression':
             is_term = True
 
-            is_first = len(self.node_list[-1].findall('./')) == 0
+            is_first = self.child_counts[-1] == 0
             is_symbol = value in '<>"&'
             is_arithmetic = value in '+*/='
             is_not_negation = value == '-' and not is_first
@@ -308,10 +384,9 @@ class Parser:
                 is_term=False
 
 
-        if len(self.node_list[-1].findall('./')) > 0:
-            if self.node_list[-1].findall('./')[-1].text:
-                if self.node_list[-1].findall('./')[-1].text in '~-':
-                    is_term = True
+        last_child_text = self.last_child_texts[-1]
+        if last_child_text and last_child_text in '~-':
+            is_term = True
 
         if is_term:
             # print('writing term')
@@ -408,15 +483,23 @@ class Parser:
         assert False, 'Parse until close should not reach end of method'
 
     def _open(self, type):
-        print('open type: ' + type)
+        if self.trace:
+            logger.debug('open type: %s', type)
         # print('  '*self.depth + '<{}>'.format(type))
         if self.node_list:
             new_node = SubElement(self.node_list[-1], type)
+            self.child_counts[-1] += 1
+            self.last_child_texts[-1] = None
         else:
             new_node = Element(type)
             self.tree._setroot(new_node)
+            if self.sink:
+                self.sink.open_class(new_node)
 
         self.node_list.append(new_node)
+        self.child_counts.append(0)
+        self.last_child_texts.append(None)
+        self.open_tags[type] = self.open_tags.get(type, 0) + 1
         self.depth += 1
 
         # if new scope opened by if or while statement, open new scope
@@ -428,12 +511,39 @@ class Parser:
     def _close(self):
         self.depth -= 1
         last_node = self.node_list.pop()
+        self.child_counts.pop()
+        self.last_child_texts.pop()
+        self.open_tags[last_node.tag] -= 1
         if (last_node.attrib.get('kind') in {'class', 'subroutine'}) or (last_node.tag in {'ifStatement', 'whileStatement'}):
-            print(self.symbol_table.name + ' popped')
-            for tup in [(x.name, x.type, x.kind, x.parent, x.var_num) for x in self.symbol_table.values()]:
-                print(tup)
-            print()
+            if self.trace:
+                logger.debug('%s popped', self.symbol_table.name)
+                for x in self.symbol_table.values():
+                    logger.debug('%s', (x.name, x.type, x.kind, x.parent, x.var_num))
             self.symbol_table = self.symbol_table.parent_table
+
+        if self.sink:
+            self._stream_closed(last_node)
+        return None
+
+    def _stream_closed(self, last_node):
+        ''' in stream mode, write out the class-level nodes once last_node
+        has closed a declaration or the class itself
+        '''
+        if not self.node_list:
+            self._flush_class()
+            self.sink.close_class(last_node)
+        elif len(self.node_list) == 1 and last_node.tag in streamed_declarations:
+            self._flush_class()
+        return None
+
+    def _flush_class(self):
+        ''' hand every finished child of the class node to the sink and
+        drop them from the tree
+        '''
+        root = self.tree.getroot()
+        for child in root:
+            self.sink.write_child(child)
+        del root[:]
         return None
 
     def _add_new_token(self, value, token_type):
@@ -445,14 +555,13 @@ class Parser:
             #   a) already being in the symbol table
             #   b) being in a let or do statement
             #   c) being used as an object_type to defind a new variable
-            tag_set = set([node.tag for node in self.node_list])
             is_being_defined = not (
                 # a
                 (value in self.symbol_table) or
                 # b
                 (
-                    ('letStatement' in tag_set) or
-                    ('doStatement' in tag_set)
+                    self.open_tags.get('letStatement') or
+                    self.open_tags.get('doStatement')
                 ) or
                 # c
                 (
@@ -475,8 +584,11 @@ class Parser:
 
         new_element = SubElement(self.node_list[-1], token_type, attrib=attributes)
         new_element.text = value
+        self.child_counts[-1] += 1
+        self.last_child_texts[-1] = value
 
-        print(new_element.tag, new_element.text, new_element.attrib, end='\n\n')
+        if self.trace:
+            logger.debug('%s %s %s', new_element.tag, new_element.text, new_element.attrib)
 
         return None
 
@@ -487,7 +599,7 @@ class Parser:
         elif parent_tag == 'varDec':
             return 'var'
         elif parent_tag == 'classVarDec':
-            class_var_category = self.node_list[-1].findall('./keyword')[0].text
+            class_var_category = self._first_child_text(self.node_list[-1], 'keyword')
             assert class_var_category in {'static', 'field'}, 'Unrecognized class_var_category: {}'.format(class_var_category)
             return class_var_category
         elif parent_tag == 'parameterList':
@@ -498,7 +610,8 @@ class Parser:
             return False
 
     def _assign_type(self, category, value):
-        print(category, value)
+        if self.trace:
+            logger.debug('%s %s', category, value)
         if category == 'class':
             # return class name
             return value
@@ -506,20 +619,30 @@ class Parser:
             # second entry under parent (varDec or classVarDec) should hold var type
             # e.g. var int x, y, z;
             # e.g. var SquareGame x, y, z;
-            type = self.node_list[-1].findall('./')[1].text
+            type = self.node_list[-1][1].text
             return type
         elif category == 'argument':
-            type = self.node_list[-1].findall('./keyword')[-1].text
+            type = self._first_child_text(reversed(self.node_list[-1]), 'keyword')
             assert type in {'int', 'char', 'boolean'}, 'argument type not recognized: {}'.format(argument)
             return type
         elif category == 'subroutine':
             # it if's a subroutine, the type will be the first thing after the parent token "<subroutineDec>"
-            type = self.node_list[-1].findall('./')[0].text
+            type = self.node_list[-1][0].text
             assert (type in subroutines), 'Sub-routine type not recognized: {}'.format(type)
             return type
         else:
             assert False, 'category not recognized: {}'.format(category)
 
+    def _first_child_text(self, children, tag):
+        ''' text of the first node in children with the given tag. The
+        nodes looked for sit next to the start (or end) of their parent, so
+        this stops after a step or two
+        '''
+        for child in children:
+            if child.tag == tag:
+                return child.text
+        raise IndexError('no {} child'.format(tag))
+
     def _add_raw_token(self, token):
         value, type = self._split_token(token)
         self._add_new_token(value, type)
@@ -535,10 +658,7 @@ class Parser:
         self.parse(next(self.token_iter))
 
     def _split_token(self, token):
-        if token.text:
-            token.text = token.text.strip()
-        value, type = token.text, token.tag
-        return value, type
+        return token.value.strip(), token.kind
 
     def _format_string(self, s):
         if s[0] == '<':
@@ -556,6 +676,307 @@ class Parser:
             f.write(tostring(self.tree.getroot(), encoding='utf8').decode('utf8'))
         return None
 
+
+class DescentParser(Parser):
+    ''' Recursive-descent engine with one method per grammar rule. Tokens are
+    read through a one-token buffer (_peek/_advance), so every token is
+    looked at once and nothing is dispatched twice. It tags declared
+    identifiers with kind/type attributes the same way as Parser, but the
+    trees differ where Parser mis-parses: Parser nests a binary operator that
+    follows a unary term inside that term (-x + y), and takes a string
+    constant that spells a symbol, such as ")", for the symbol
+    '''
+    def __init__(self, tokenizer):
+        super().__init__(tokenizer)
+        self.current = next(self.token_iter, None)
+        return None
+
+    def _parse_tokens(self):
+        self._compile_class()
+        return None
+
+    # token buffer
+    def _peek(self):
+        ''' value of the next token, without consuming it, if it is a symbol
+        or keyword. Any other token gives None, so a string constant such as
+        ")" is never taken for the symbol it spells
+        '''
+        assert self.current is not None, 'unexpected end of file'
+        if self.current.kind in grammar_kinds:
+            return self.current.value
+        return None
+
+    def _advance(self):
+        token = self.current
+        assert token is not None, 'unexpected end of file'
+        self.current = next(self.token_iter, None)
+        return token
+
+    def _add(self, expected=None):
+        ''' consume the next token and add it to the open node '''
+        token = self._advance()
+        assert expected is None or (token.kind in grammar_kinds
+                                    and token.value == expected), \
+            'expected {} at line {}, column {}, found {}'.format(
+                expected, token.line, token.column, token.value)
+        new_element = SubElement(self.node_list[-1], token.kind)
+        new_element.text = token.value
+        return token
+
+    def _add_declared(self, kind, type):
+        ''' consume an identifier being declared. As in Parser, it is
+        recorded in the symbol table and tagged with kind and type unless it is
+        already known, or capitalized and not a class name
+        '''
+        token = self._advance()
+        name = token.value
+        attributes = {}
+        if not (name in self.symbol_table or
+                (kind != 'class' and name[0].isupper())):
+            attributes['kind'] = kind
+            attributes['type'] = type
+            self.symbol_table.new_symbol(name, type, kind)
+
+        new_element = SubElement(self.node_list[-1], 'identifier', attrib=attributes)
+        new_element.text = name
+        return token
+
+    def _open(self, type):
+        if self.node_list:
+            new_node = SubElement(self.node_list[-1], type)
+        else:
+            new_node = Element(type)
+            self.tree._setroot(new_node)
+            if self.sink:
+                self.sink.open_class(new_node)
+        self.node_list.append(new_node)
+        return None
+
+    def _close(self):
+        last_node = self.node_list.pop()
+        if self.sink:
+            self._stream_closed(last_node)
+        return None
+
+    # program structure
+    def _compile_class(self):
+        self._open('class')
+        self._add('class')
+        name = self.current.value
+        self._add_declared('class', name)
+        self._add('{')
+
+        while self._peek() in {'static', 'field'}:
+            self._compile_class_var_dec()
+        while self._peek() in subroutines:
+            self._compile_subroutine()
+
+        self._add('}')
+        self._close()
+        return None
+
+    def _compile_class_var_dec(self):
+        self._open('classVarDec')
+        kind = self._add().value
+        type = self._add().value
+        self._add_declared(kind, type)
+        while self._peek() == ',':
+            self._add(',')
+            self._add_declared(kind, type)
+        self._add(';')
+        self._close()
+        return None
+
+    def _compile_subroutine(self):
+        self._open('subroutineDec')
+        subroutine_type = self._add().value
+        # return type
+        self._add()
+        self._add_declared('subroutine', subroutine_type)
+
+        self._add('(')
+        self._compile_parameter_list()
+        self._add(')')
+
+        self._open('subroutineBody')
+        self._add('{')
+        while self._peek() == 'var':
+            self._compile_var_dec()
+        self._compile_statements()
+        self._add('}')
+        self._close()
+
+        self._close()
+        return None
+
+    def _compile_parameter_list(self):
+        self._open('parameterList')
+        if self._peek() != ')':
+            type = self._add().value
+            self._add_declared('argument', type)
+            while self._peek() == ',':
+                self._add(',')
+                type = self._add().value
+                self._add_declared('argument', type)
+        self._close()
+        return None
+
+    def _compile_var_dec(self):
+        self._open('varDec')
+        self._add('var')
+        type = self._add().value
+        self._add_declared('var', type)
+        while self._peek() == ',':
+            self._add(',')
+            self._add_declared('var', type)
+        self._add(';')
+        self._close()
+        return None
+
+    # statements
+    def _compile_statements(self):
+        self._open('statements')
+        statement_switch = {
+            'let': self._compile_let,
+            'if': self._compile_if,
+            'while': self._compile_while,
+            'do': self._compile_do,
+            'return': self._compile_return,
+        }
+        while self._peek() in statement_keywords:
+            statement_switch[self._peek()]()
+        self._close()
+        return None
+
+    def _compile_let(self):
+        self._open('letStatement')
+        self._add('let')
+        self._add()
+        if self._peek() == '[':
+            self._add('[')
+            self._compile_expression()
+            self._add(']')
+        self._add('=')
+        self._compile_expression()
+        self._add(';')
+        self._close()
+        return None
+
+    def _compile_if(self):
+        self._open('ifStatement')
+        self._add('if')
+        self._add('(')
+        self._compile_expression()
+        self._add(')')
+        self._add('{')
+        self._compile_statements()
+        self._add('}')
+        if self._peek() == 'else':
+            self._add('else')
+            self._add('{')
+            self._compile_statements()
+            self._add('}')
+        self._close()
+        return None
+
+    def _compile_while(self):
+        self._open('whileStatement')
+        self._add('while')
+        self._add('(')
+        self._compile_expression()
+        self._add(')')
+        self._add('{')
+        self._compile_statements()
+        self._add('}')
+        self._close()
+        return None
+
+    def _compile_do(self):
+        self._open('doStatement')
+        self._add('do')
+        self._add()
+        self._compile_call_rest()
+        self._add(';')
+        self._close()
+        return None
+
+    def _compile_return(self):
+        self._open('returnStatement')
+        self._add('return')
+        if self._peek() != ';':
+            self._compile_expression()
+        self._add(';')
+        self._close()
+        return None
+
+    # expressions
+    def _compile_expression(self):
+        self._open('expression')
+        self._compile_term()
+        while self._peek() in binary_operators:
+            self._add()
+            self._compile_term()
+        self._close()
+        return None
+
+    def _compile_term(self):
+        self._open('term')
+        token = self._add()
+        value = token.value
+
+        if token.kind == 'identifier':
+            next_value = self._peek()
+            if next_value == '[':
+                self._add('[')
+                self._compile_expression()
+                self._add(']')
+            elif next_value in {'(', '.'}:
+                self._compile_call_rest()
+        elif token.kind == 'symbol':
+            if value == '(':
+                self._compile_expression()
+                self._add(')')
+            else:
+                assert value in unary_operators, \
+                    'unexpected symbol {} at line {}, column {}'.format(
+                        value, token.line, token.column)
+                self._compile_term()
+        elif token.kind == 'keyword':
+            assert value in keyword_constants, \
+                'unexpected keyword {} at line {}, column {}'.format(
+                    value, token.line, token.column)
+
+        self._close()
+        return None
+
+    def _compile_call_rest(self):
+        ''' the part of a subroutine call after its first identifier:
+        [. name] ( expressionList )
+        '''
+        if self._peek() == '.':
+            self._add('.')
+            self._add()
+        self._add('(')
+        self._compile_expression_list()
+        self._add(')')
+        return None
+
+    def _compile_expression_list(self):
+        self._open('expressionList')
+        if self._peek() != ')':
+            self._compile_expression()
+            while self._peek() == ',':
+                self._add(',')
+                self._compile_expression()
+        self._close()
+        return None
+
+
+engines = {
+    'legacy': Parser,
+    'descent': DescentParser,
+}
+
 if __name__ == '__main__':
     input_arg = sys.argv[1]
 
@@ -1,5 +1,6 @@
 # Developed for project 10 of nand2tetris course
 from pathlib import Path
+import re
 import sys
 
 keywords = {
@@ -33,12 +34,79 @@ symbol_substitutions = {
     '&': '&amp;'
 }
 
+# master pattern for the scan engine. Each match is any leading whitespace
+# followed by one token or comment. Words run up to a symbol or whitespace
+# and are told apart as keyword, integer or identifier afterwards, by the
+# whole word, so names such as done or charAt stay single identifiers. The
+# legacy engine instead matches keywords as prefixes of a word
+_symbol_class = ''.join(re.escape(symbol) for symbol in sorted(symbols))
+token_pattern = re.compile(r'''
+    \s*
+    (?:
+      (?P<comment>//[^\n]*\n?)
+    | (?P<doc_comment>/\*\*)
+    | (?P<string>")
+    | (?P<symbol>[{symbols}])
+    | (?P<word>[^{symbols}\s]+)
+    | (?P<end>$)
+    )
+'''.format(symbols=_symbol_class), re.VERBOSE)
+
+engines = {'scan', 'legacy'}
+
+# characters the scan engine reads from the input at a time
+chunk_size = 1 << 16
+
+
+def _doc_comment_end(text, position):
+    ''' index of the last character of the doc comment whose body starts at
+    position: the end of the first line that ends with */. -1 if text runs out
+    first
+    '''
+    while True:
+        line_end = text.find('\n', position)
+        line_end = len(text) if line_end == -1 else line_end + 1
+        if text[position:line_end].strip()[-2:] == '*/':
+            return line_end - 1
+        if line_end == len(text):
+            return -1
+        position = line_end
+
+
+class Token:
+    ''' A single token as produced by Tokenizer: its kind (the XML tag name,
+    e.g. keyword or integerConstant), its unescaped value and the line and
+    column where it starts
+    '''
+    __slots__ = ('kind', 'value', 'line', 'column')
+
+    def __init__(self, kind, value, line=None, column=None):
+        self.kind = kind
+        self.value = value
+        self.line = line
+        self.column = column
+
+    def __repr__(self):
+        return 'Token({!r}, {!r}, {}, {})'.format(
+            self.kind, self.value, self.line, self.column)
+
+    def to_xml(self):
+        value = self.value
+        # if token is a reserved symbol, replace it with the appropriate
+        # replacement
+        if self.kind == 'symbol':
+            value = symbol_substitutions.get(value, value)
+        return '\t<{}> {} </{}>\n'.format(self.kind, value, self.kind)
+
+
 class Tokenizer:
-    def __init__(self, input_file=None):
+    def __init__(self, input_file=None, engine='scan'):
+        assert engine in engines, 'unknown tokenizer engine: {}'.format(engine)
         self.input = None
         self.output = None
         self.stored_value = ''
         self.string_stop = None
+        self.engine = engine
 
         if input_file:
             self._open_stream(input_file)
@@ -55,7 +123,8 @@ class Tokenizer:
 
     def tokenize(self, output_file=None):
         ''' tokenize the input stream. If an output filename is provided, save
-        results to the file. Otherwise return a generator for Parser use.
+        results to the file as XML. Otherwise return a generator of Token
+        objects for Parser use.
         '''
         if output_file:
             self._write_stream(output_file)
@@ -68,30 +137,102 @@ class Tokenizer:
         assert (self.output), \
             "Output must be defined to write to file"
 
+        self.output.write('<tokens>\n')
         for token in self._tokenization_iterator():
-            self.output.write(token)
+            self.output.write(token.to_xml())
+        self.output.write('</tokens>\n')
 
         self.output.close()
         return None
 
     def _tokenization_iterator(self):
-        yield '<tokens>\n'
+        if self.engine == 'scan':
+            return self._scan_tokens()
+        else:
+            return self._read_tokens()
+
+    def _scan_tokens(self):
+        ''' read the input in chunks and walk it with a cursor, matching one
+        token (or run of whitespace/comment) at a time with token_pattern.
+        Text before the last token is dropped whenever a chunk is read, so
+        memory use does not grow with the size of the input
+        '''
+        read = self.input.read
+        match = token_pattern.match
+        text, at_end = '', False
+        position = 0
+        line, line_start, last_start = 1, 0, 0
+        while True:
+            found = match(text, position)
+            kind = found.lastgroup
+            start = found.start(kind)
+            stop = found.end()
+            if kind == 'string':
+                stop = text.find('"', stop) + 1
+            elif kind == 'doc_comment':
+                stop = _doc_comment_end(text, stop) + 1
+
+            # a match that runs into the end of the text read so far may go
+            # on in the next chunk, so read more and match again. Two more
+            # characters are enough to tell / from // and /**
+            if not at_end and (stop == 0 or stop + 2 >= len(text)):
+                chunk = read(chunk_size)
+                at_end = not chunk
+                text = text[last_start:] + chunk
+                position -= last_start
+                line_start -= last_start
+                last_start = 0
+                continue
+
+            if kind == 'end':
+                break
+
+            # whitespace, comments and strings since the last token may span
+            # lines
+            newlines = text.count('\n', last_start, start)
+            if newlines:
+                line += newlines
+                line_start = text.rfind('\n', last_start, start) + 1
+            last_start = start
+            position = found.end()
+            column = start - line_start + 1
+
+            if kind == 'word':
+                token = found.group(kind)
+                if token in keywords:
+                    yield Token('keyword', token, line, column)
+                elif token.isdigit():
+                    yield Token('integerConstant', token, line, column)
+                else:
+                    yield Token('identifier', token, line, column)
+            elif kind == 'symbol':
+                yield Token('symbol', found.group(kind), line, column)
+            elif kind == 'string':
+                assert stop != 0, 'EOF reach while compiling string, \
+                    expected closing "'
+                yield Token('stringConstant', text[position:stop - 1],
+                            line, column)
+                position = stop
+            elif kind == 'doc_comment':
+                if stop == 0:
+                    break
+                position = stop
+
+        self.input.close()
+        return None
 
+    def _read_tokens(self):
+        ''' legacy engine: read the input one character at a time. Does not
+        track token positions
+        '''
         while True:
-            # print('entering while loop')
             token, token_type = self._get_next_token()
             if token_type == 'EOF':
                 break
-
-            token_string = '\t<{}> {} </{}>\n'.format(token_type,
-                                                      token,
-                                                      token_type
-                                                      )
-            # print('writing {} {}'.format(token, token_type))
-            yield token_string
+            yield Token(token_type, token)
 
         self.input.close()
-        yield '</tokens>\n'
+        return None
 
     def _get_next_token(self):
         terminators = {' ', '\n', ''}
@@ -168,12 +309,6 @@ class Tokenizer:
                             self.stored_value = new_char
                     else:
                         self.stored_value = new_char
-                # if symbol is not a slash, make sure it is not a reserved
-                # character
-                elif token in symbol_substitutions:
-                    # if token is a reserved symbol, replace it with the appropriate
-                    # replacement
-                    token = symbol_substitutions[token]
                 return (token, 'symbol')
             # if token runs into a symbol, it is an identifier. Store the
             # symbol to be handled later
@@ -1,16 +1,33 @@
 # Developed for project 10 of nand2tetris course
+import logging
+
+# scope tracing, off unless the SymbolTable logger is set to DEBUG
+logger = logging.getLogger('SymbolTable')
+
+
 class SymbolTable(dict):
+    ''' Symbols declared in one scope. Names from enclosing scopes are found
+    by following parent_table instead of copying them in, and the index of
+    each new symbol comes from a running count per kind
+    '''
     def __init__(self, class_name, parent_table=None):
-        print('new symbol table: {}'.format(class_name))
+        trace = logger.isEnabledFor(logging.DEBUG)
+        if trace:
+            logger.debug('new symbol table: %s', class_name)
         self.parent_table = parent_table
+        # number of symbols of each kind visible from this scope, which is
+        # the var_num of the next symbol of that kind
+        self.kind_counts = {}
         if parent_table:
-            self.update(parent_table)
-            print('inherited table: {}'.format(parent_table.name))
-            print('inherited keys: {}'.format(parent_table.keys()))
+            self.kind_counts.update(parent_table.kind_counts)
+            if trace:
+                logger.debug('inherited table: %s', parent_table.name)
         self.name = class_name
         return None
 
     class Symbol():
+        __slots__ = ('name', 'type', 'kind', 'parent', 'var_num')
+
         def __init__(self, name, type, kind, parent, var_num):
             self.name = name
             self.type = type
@@ -21,11 +38,34 @@ class SymbolTable(dict):
         def is_in_class(self, class_name):
             return self.parent == class_name
 
+    def __contains__(self, name):
+        table = self
+        while table is not None:
+            if dict.__contains__(table, name):
+                return True
+            table = table.parent_table
+        return False
+
+    def __missing__(self, name):
+        if self.parent_table is None:
+            raise KeyError(name)
+        return self.parent_table[name]
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
     def is_in_class(self, symbol):
         return symbol.parent == self.name
 
+    def var_count(self, kind):
+        return self.kind_counts.get(kind, 0)
+
     def new_symbol(self, var_name, type, kind, parent=None):
         if not parent: parent = self.name
-        var_num = len([symbol for symbol in self if self[symbol].kind == kind])
+        var_num = self.kind_counts.get(kind, 0)
+        self.kind_counts[kind] = var_num + 1
         self[var_name] = self.Symbol(var_name, type, kind, parent, var_num)
         return None
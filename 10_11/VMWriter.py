@@ -0,0 +1,50 @@
+# Developed for project 11 of nand2tetris course
+class VMWriter:
+    ''' Write VM commands to a .vm file as they are generated '''
+    def __init__(self, filename):
+        self.output = open(filename, 'w', encoding='utf-8')
+        return None
+
+    def _write(self, *fields):
+        self.output.write(' '.join(str(field) for field in fields) + '\n')
+        return None
+
+    def write_push(self, segment, index):
+        self._write('push', segment, index)
+        return None
+
+    def write_pop(self, segment, index):
+        self._write('pop', segment, index)
+        return None
+
+    def write_arithmetic(self, command):
+        self._write(command)
+        return None
+
+    def write_label(self, label):
+        self._write('label', label)
+        return None
+
+    def write_goto(self, label):
+        self._write('goto', label)
+        return None
+
+    def write_if(self, label):
+        self._write('if-goto', label)
+        return None
+
+    def write_call(self, name, num_args):
+        self._write('call', name, num_args)
+        return None
+
+    def write_function(self, name, num_locals):
+        self._write('function', name, num_locals)
+        return None
+
+    def write_return(self):
+        self._write('return')
+        return None
+
+    def close(self):
+        self.output.close()
+        return None
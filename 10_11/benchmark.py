@@ -0,0 +1,159 @@
+# Throughput benchmarks for the Jack analyzer. Run from this directory:
+#   python benchmark.py [size_in_MB]
+from pathlib import Path
+import sys
+import tempfile
+import time
+
+from JackParser import engines
+from JackTokenizer import Tokenizer
+
+jack_sources = Path(__file__).resolve().parent.parent / '09'
+
+
+def make_corpus(directory, size_mb=1.0):
+    ''' Write a large .jack file made of the Tetris sources repeated until
+    the file reaches size_mb megabytes, and return its path
+    '''
+    sample = ''.join(
+        file.read_text(encoding='utf-8')
+        for file in sorted(jack_sources.glob('*.jack'))
+    )
+    repeats = max(1, int(size_mb * 1024 * 1024 / len(sample)))
+
+    path = Path(directory) / 'Corpus.jack'
+    path.write_text(sample * repeats, encoding='utf-8')
+    return path
+
+
+def make_long_expression_class(directory, terms):
+    ''' Write a synthetic class whose subroutine holds one let statement
+    with a right hand side of the given number of terms
+    '''
+    operands = ['x', 'y', '(x * 2)', 'a[y]']
+    expression = ' + '.join(operands[i % len(operands)] for i in range(terms))
+    source = '''class Long {{
+  method int run(int x, int y) {{
+    var int z;
+    var Array a;
+    let z = {};
+    return z;
+  }}
+}}
+'''.format(expression)
+
+    path = Path(directory) / 'Long{}.jack'.format(terms)
+    path.write_text(source, encoding='utf-8')
+    return path
+
+
+# the legacy parser mis-parses a binary operator after a unary term
+# (-x + y) and string constants that spell a symbol (")"), so the corpus
+# has neither, and both engines write the same XML for it
+subroutine_template = '''
+  method int run{n}(int x, int y) {{
+    var int i, j;
+    var Array arr;
+    let i = x + y * a0 - a1 / 2;
+    let arr[i] = -x;
+    while (i < a0) {{ let i = i + 1; }}
+    if (x > y) {{ let j = x; }} else {{ let j = (y + 1) * 2; }}
+    do run{n}(i, j);
+    do Output.printString("run {n}");
+    return i + j;
+  }}
+'''
+
+
+def make_parser_corpus(directory, subroutines):
+    ''' Write a synthetic class with the given number of subroutines, using
+    only constructs that both parser engines handle
+    '''
+    body = ''.join(subroutine_template.format(n=n) for n in range(subroutines))
+    source = 'class Corpus {{\n  field int a0, a1;\n{}}}\n'.format(body)
+
+    path = Path(directory) / 'ParserCorpus.jack'
+    path.write_text(source, encoding='utf-8')
+    return path
+
+
+def time_call(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def tokenize_all(path, engine):
+    return [
+        (token.kind, token.value)
+        for token in Tokenizer(input_file=str(path), engine=engine).tokenize()
+    ]
+
+
+def bench_tokenizer(path):
+    ''' Tokenize path with each tokenizer engine, check they agree, and
+    report throughput in MB/s
+    '''
+    size_mb = path.stat().st_size / (1024 * 1024)
+    print('tokenizer: {:.2f} MB'.format(size_mb))
+
+    results = {}
+    for engine in ('legacy', 'scan'):
+        seconds, tokens = time_call(tokenize_all, path, engine)
+        results[engine] = tokens
+        print('  {:<8} {:8.3f} s {:8.2f} MB/s {:>10} tokens'.format(
+            engine, seconds, size_mb / seconds, len(tokens)))
+
+    assert results['legacy'] == results['scan'], \
+        'tokenizer engines disagree'
+    return None
+
+
+def parse_file(path, output_path, engine='legacy'):
+    tokenizer = Tokenizer(input_file=str(path)).tokenize()
+    engines[engine](tokenizer).parse_to_file(str(output_path))
+    return None
+
+
+def bench_parser_engines(directory, subroutines=500):
+    ''' Parse the same synthetic class with each parser engine, check the
+    XML they write is identical, and report tokens per second
+    '''
+    path = make_parser_corpus(directory, subroutines)
+    num_tokens = len(tokenize_all(path, 'scan'))
+    print('parser engines: {} tokens'.format(num_tokens))
+
+    outputs = {}
+    for engine in ('legacy', 'descent'):
+        output_path = path.with_name('{}.{}.xml'.format(path.stem, engine))
+        seconds, _ = time_call(parse_file, path, output_path, engine)
+        outputs[engine] = output_path.read_bytes()
+        print('  {:<8} {:8.3f} s {:10.0f} tokens/s'.format(
+            engine, seconds, num_tokens / seconds))
+
+    assert outputs['legacy'] == outputs['descent'], \
+        'parser engines disagree'
+    return None
+
+
+def bench_long_expressions(directory, sizes=(500, 1000, 2000, 4000)):
+    ''' Parse classes with increasingly long expressions. With linear
+    parsing the time per term stays flat as the expression grows
+    '''
+    print('long expressions:')
+    for terms in sizes:
+        path = make_long_expression_class(directory, terms)
+        seconds, _ = time_call(parse_file, path, path.with_suffix('.xml'))
+        print('  {:>6} terms {:8.3f} s {:8.1f} us/term'.format(
+            terms, seconds, seconds / terms * 1e6))
+    return None
+
+
+if __name__ == '__main__':
+    size_mb = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+
+    with tempfile.TemporaryDirectory() as directory:
+        corpus = make_corpus(directory, size_mb)
+        bench_tokenizer(corpus)
+        bench_long_expressions(directory)
+        bench_parser_engines(directory)